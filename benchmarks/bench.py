@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+"""Benchmarks for ESClient, esdump and esimport, against the mock
+ElasticSearch server of mock_es.py, so no cluster is needed.
+
+Every scenario runs in a new Python process with its own mock server, so
+that the peak RSS that is reported belongs to that scenario alone. For
+every scenario the throughput (documents and requests per second), the
+latency percentiles of the requests (the time to encode the body, wait
+for the response and decode it), the bytes sent and received and the peak
+RSS are reported.
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --scenarios bulk:500 scroll --latency 0.001
+    python benchmarks/bench.py --save baseline.json
+    python benchmarks/bench.py --baseline baseline.json
+
+With --baseline, the exit status is 1 when the throughput of a scenario is
+more than --tolerance lower than in the baseline, or its p99 latency more
+than --tolerance higher.
+
+The scenarios are:
+
+index -- index the documents one by one
+bulk:N -- bulk_index() the documents, pushing every N of them
+parallel_bulk:N -- parallel_bulk() with chunks of N documents
+mget:N -- get_many() the documents, N per request
+scroll:N -- iter_scan() all documents with pages of N documents
+scroll_stream:N -- the same with stream=True
+roundtrip -- esdump the documents to a file and esimport that file
+roundtrip:OPTION -- the same with esdump --OPTION, e.g. gzip or container
+
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import esclient
+from mock_es import MockElasticsearch
+
+DEFAULT_SCENARIOS = ['index', 'bulk:100', 'bulk:1000', 'bulk:5000',
+                     'parallel_bulk:500', 'mget:100', 'scroll:500',
+                     'scroll_stream:500', 'roundtrip', 'roundtrip:gzip']
+
+READ_INDEX = 'bench'
+WRITE_INDEX = 'bench_write'
+DOCTYPE = 'doc'
+
+_now = esclient._now
+
+
+def make_docs(arguments):
+    text = 'x' * max(arguments.doc_size - 20, 0)
+    return [{'id': number, 'text': text} for number in range(arguments.docs)]
+
+
+#
+# The scenarios. Each one returns the number of documents it handled, the
+# time it started, after its preparations, and optionally a dict with extra
+# results.
+#
+
+def bench_index(es, url, arguments, param):
+    docs = make_docs(arguments)[:arguments.index_docs]
+    start = _now()
+    for number, doc in enumerate(docs):
+        es.index(WRITE_INDEX, DOCTYPE, doc, number)
+    return len(docs), start
+
+
+def bench_bulk(es, url, arguments, param):
+    docs = make_docs(arguments)
+    es.bulk_buffer.max_actions = int(param or 500)
+    start = _now()
+    for number, doc in enumerate(docs):
+        es.bulk_index(WRITE_INDEX, DOCTYPE, doc, number)
+    es.bulk_push()
+    return len(docs), start
+
+
+def bench_parallel_bulk(es, url, arguments, param):
+    actions = [{'_index': WRITE_INDEX, '_type': DOCTYPE, '_id': number,
+                '_source': doc}
+               for number, doc in enumerate(make_docs(arguments))]
+    start = _now()
+    for result in es.parallel_bulk(actions, chunk_size=int(param or 500),
+                                   workers=arguments.workers):
+        if not result:
+            raise esclient.ESClientException("Bulk failed: %r" % result)
+    return len(actions), start
+
+
+def bench_mget(es, url, arguments, param):
+    batch = int(param or 100)
+    start = _now()
+    for first in range(0, arguments.docs, batch):
+        ids = range(first, min(first + batch, arguments.docs))
+        es.get_many([(READ_INDEX, DOCTYPE, docid) for docid in ids])
+    return arguments.docs, start
+
+
+def bench_scroll(es, url, arguments, param, stream=False):
+    start = _now()
+    count = 0
+    for hit in es.iter_scan(indexes=[READ_INDEX], size=int(param or 500),
+                            stream=stream):
+        count += 1
+    return count, start
+
+
+def bench_scroll_stream(es, url, arguments, param):
+    return bench_scroll(es, url, arguments, param, stream=True)
+
+
+def run_script(name, args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = _now()
+    subprocess.check_call([sys.executable, os.path.join(ROOT, 'bin', name)] +
+                          args, env=env, stdout=subprocess.PIPE)
+    return _now() - start
+
+
+def bench_roundtrip(es, url, arguments, param):
+    directory = tempfile.mkdtemp()
+    try:
+        # esimport recognizes compressed dumps by their extension
+        extension = {'gzip': '.gz', 'bzip2': '.bz2'}.get(param, '')
+        filename = os.path.join(directory, 'dump.json' + extension)
+        options = ['--' + param] if param else []
+        start = _now()
+        dump = run_script('esdump', ['-u', url, '-i', READ_INDEX,
+                                     '-f', filename] + options)
+        load = run_script('esimport', ['-u', url, '-f', filename,
+                                       '-i', WRITE_INDEX,
+                                       '-w', str(arguments.workers)])
+        size = os.path.getsize(filename)
+    finally:
+        shutil.rmtree(directory)
+    return arguments.docs, start, {'dump_seconds': dump,
+                                   'import_seconds': load,
+                                   'file_mb': size / 1048576.0}
+
+
+SCENARIOS = {
+    'index': bench_index,
+    'bulk': bench_bulk,
+    'parallel_bulk': bench_parallel_bulk,
+    'mget': bench_mget,
+    'scroll': bench_scroll,
+    'scroll_stream': bench_scroll_stream,
+    'roundtrip': bench_roundtrip,
+}
+
+
+#
+# Running and reporting
+#
+
+def peak_rss_mb():
+    """Return the peak RSS in MB of this process and of its children that
+    have finished, whichever is larger."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # In bytes on macOS, in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak / 1048576.0
+    return peak / 1024.0
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def run_scenario(name, arguments):
+    """Run one scenario in this process and return its results."""
+    scenario, _, param = name.partition(':')
+    mock = None
+    url = arguments.url
+    if url is None:
+        mock = MockElasticsearch(latency=arguments.latency,
+                                 doc_count=arguments.docs,
+                                 doc_size=arguments.doc_size,
+                                 indexes=[READ_INDEX], doctype=DOCTYPE)
+        mock.start()
+        url = mock.url
+    try:
+        es = esclient.ESClient(url, metrics=True, codec=arguments.codec,
+                               pool_maxsize=max(10, arguments.workers))
+        requests = []
+        es.add_hook('after_request',
+                    lambda request, response: requests.append(request))
+        outcome = SCENARIOS[scenario](es, url, arguments, param)
+        elapsed = _now() - outcome[1]
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    # The parse time is added to a request after its hooks were called
+    latencies = sorted(request['serialize'] + request['network'] +
+                       request.get('parse', 0) for request in requests)
+    operations = es.metrics.snapshot()['operations'].values()
+    result = {
+        'scenario': name,
+        'docs': outcome[0],
+        'seconds': elapsed,
+        'docs_per_second': outcome[0] / elapsed,
+        'requests': len(requests),
+        'requests_per_second': len(requests) / elapsed,
+        'mb_sent': sum(o['bytes_sent'] for o in operations) / 1048576.0,
+        'mb_received': sum(o['bytes_received']
+                           for o in operations) / 1048576.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    for key, fraction in (('p50_ms', 0.5), ('p90_ms', 0.9),
+                          ('p99_ms', 0.99)):
+        value = percentile(latencies, fraction)
+        result[key] = value * 1000 if value is not None else None
+    for phase in ('serialize', 'network', 'parse'):
+        result[phase + '_seconds'] = sum(o[phase]['sum'] for o in operations)
+    if not requests:
+        # The requests were made by other processes
+        for key in ('requests', 'requests_per_second', 'mb_sent',
+                    'mb_received'):
+            result[key] = None
+    if len(outcome) > 2:
+        result.update(outcome[2])
+    return result
+
+
+def child_arguments(arguments):
+    args = ['--docs', str(arguments.docs),
+            '--doc-size', str(arguments.doc_size),
+            '--index-docs', str(arguments.index_docs),
+            '--latency', str(arguments.latency),
+            '--workers', str(arguments.workers),
+            '--codec', arguments.codec]
+    if arguments.url:
+        args += ['--url', arguments.url]
+    return args
+
+
+def run_in_child(name, arguments):
+    """Run a scenario in a new process, to measure its peak RSS alone."""
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--run', name] +
+        child_arguments(arguments))
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def format_value(value, digits=1):
+    if value is None:
+        return '-'
+    return '%.*f' % (digits, value)
+
+
+def print_results(results):
+    columns = [('scenario', 'scenario', None), ('docs/s', 'docs_per_second', 0),
+               ('req/s', 'requests_per_second', 0), ('p50 ms', 'p50_ms', 2),
+               ('p90 ms', 'p90_ms', 2), ('p99 ms', 'p99_ms', 2),
+               ('MB sent', 'mb_sent', 1), ('MB recv', 'mb_received', 1),
+               ('RSS MB', 'peak_rss_mb', 1)]
+    rows = [[title for title, _, _ in columns]]
+    for result in results:
+        rows.append([result[key] if digits is None else
+                     format_value(result[key], digits)
+                     for _, key, digits in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) if i == 0 else cell.rjust(width)
+                        for i, (cell, width) in enumerate(zip(row, widths))))
+
+
+def compare(results, baseline, tolerance):
+    """Print the scenarios that got slower than in the baseline and return
+    whether there were any."""
+    previous = dict((result['scenario'], result) for result in baseline)
+    regressions = False
+    for result in results:
+        old = previous.get(result['scenario'])
+        if old is None:
+            continue
+        problems = []
+        if result['docs_per_second'] < \
+                old['docs_per_second'] * (1 - tolerance):
+            problems.append('throughput %.0f -> %.0f docs/s' %
+                            (old['docs_per_second'],
+                             result['docs_per_second']))
+        if old.get('p99_ms') and result.get('p99_ms') and \
+                result['p99_ms'] > old['p99_ms'] * (1 + tolerance):
+            problems.append('p99 %.2f -> %.2f ms' % (old['p99_ms'],
+                                                     result['p99_ms']))
+        if problems:
+            regressions = True
+            print("REGRESSION %s: %s" % (result['scenario'],
+                                         ', '.join(problems)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark ESClient against a mock ElasticSearch server",
+        epilog="Scenarios: " + ", ".join(sorted(SCENARIOS)))
+    parser.add_argument('--scenarios', nargs='+', default=DEFAULT_SCENARIOS,
+                        help="The scenarios to run, with an optional "
+                        "parameter after a colon, e.g. bulk:500")
+    parser.add_argument('--docs', type=int, default=20000,
+                        help="The number of documents per scenario "
+                        "(default: 20000)")
+    parser.add_argument('--index-docs', type=int, default=2000,
+                        help="The number of documents to index one by one "
+                        "(default: 2000)")
+    parser.add_argument('--doc-size', type=int, default=200,
+                        help="The size in bytes of a document (default: 200)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds the mock server waits before every "
+                        "response (default: 0)")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Workers for parallel_bulk and esimport "
+                        "(default: 4)")
+    parser.add_argument('--codec', default='json',
+                        help="The JSON codec of the client (default: json)")
+    parser.add_argument('--url', help="Use this server instead of an "
+                        "in-process mock, e.g. a mock_es.py process. It "
+                        "needs an index '%s' with --docs documents, and "
+                        "documents are written to '%s'" %
+                        (READ_INDEX, WRITE_INDEX))
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Run every scenario this many times and keep "
+                        "the fastest run")
+    parser.add_argument('--save', help="Save the results as JSON")
+    parser.add_argument('--baseline', help="Compare the results with "
+                        "results saved with --save")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="The fraction by which a scenario may be "
+                        "slower than the baseline (default: 0.2)")
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.run:
+        print(json.dumps(run_scenario(arguments.run, arguments)))
+        return
+
+    for name in arguments.scenarios:
+        if name.partition(':')[0] not in SCENARIOS:
+            parser.error("Unknown scenario %s" % name)
+    results = []
+    for name in arguments.scenarios:
+        runs = [run_in_child(name, arguments)
+                for _ in range(arguments.repeat)]
+        results.append(max(runs, key=lambda run: run['docs_per_second']))
+    print_results(results)
+
+    if arguments.save:
+        with open(arguments.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if arguments.baseline:
+        with open(arguments.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, arguments.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
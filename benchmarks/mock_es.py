@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+"""A stand-in for ElasticSearch, to benchmark ESClient without a cluster.
+
+MockElasticsearch answers the requests that ESClient, esdump and esimport
+make: index, get, delete, _bulk, _search, _count, _mget, _msearch, scroll,
+and the index APIs they use. It does not store anything. Every index has
+doc_count generated documents with a source of about doc_size bytes, which
+searches, scrolls and gets return, and writes are acknowledged without
+keeping them. That way the server spends as little time and memory as
+possible, and what is measured is the client.
+
+The server runs in a background thread of the current process, so it
+competes with the client for the GIL. To keep it out of the way, run it
+as a separate process instead:
+
+    python benchmarks/mock_es.py --port 9250 --latency 0.002
+
+"""
+from __future__ import print_function
+import argparse
+import gzip
+import io
+import itertools
+import json
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import urlparse, parse_qsl
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote, urlparse, parse_qsl
+
+__all__ = ['MockElasticsearch']
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, which Nagle's
+    # algorithm would delay until the client acknowledges the headers
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._handle('HEAD')
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        return body
+
+    def _handle(self, method):
+        mock = self.server.mock
+        url = urlparse(self.path)
+        # ESClient quotes the commas between index names as %2C
+        parts = [unquote(part) for part in url.path.split('/') if part]
+        args = dict(parse_qsl(url.query))
+        body = self._read_body()
+        if mock.latency:
+            time.sleep(mock.latency)
+        try:
+            status, response = mock.respond(method, parts, args, body)
+        except Exception as e:
+            status, response = 500, {'error': repr(e)}
+        if not isinstance(response, bytes):
+            response = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        if method != 'HEAD':
+            self.wfile.write(response)
+
+
+class MockElasticsearch(object):
+    """An HTTP server that mimics ElasticSearch, see the module docstring.
+
+    Arguments:
+    host, port -- the address to listen on; port 0 picks a free port
+    latency -- the number of seconds to wait before answering a request
+    doc_count -- the number of documents in every index
+    doc_size -- the approximate size in bytes of the source of a document
+    indexes -- the names of the indexes that exist
+    doctype -- the type of the documents
+
+    Use it as a context manager, or call start() and stop(). requests
+    counts the requests that were answered, per path component that
+    starts with an underscore (e.g. '_bulk') or per method for the other
+    requests.
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0,
+                 doc_count=10000, doc_size=200, indexes=('bench',),
+                 doctype='doc'):
+        self.latency = latency
+        self.doc_count = doc_count
+        self.doc_size = doc_size
+        self.indexes = list(indexes)
+        self.doctype = doctype
+        self.requests = {}
+        self.lock = threading.Lock()
+        self.scrolls = {}
+        self.scroll_ids = itertools.count(1)
+        self.server = _Server((host, port), _Handler)
+        self.server.mock = self
+        self.thread = None
+        # The generated documents only differ in their id
+        self._text = 'x' * max(doc_size - 20, 0)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    #
+    # Responses
+    #
+
+    def _count(self, name):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def _select(self, names):
+        """Return the indexes a comma separated list of names refers to,
+        or None when one of them does not exist."""
+        if names in (None, '', '_all', '*'):
+            return self.indexes
+        selected = names.split(',')
+        for name in selected:
+            if name not in self.indexes:
+                return None
+        return selected
+
+    def _hit(self, index, docid):
+        return ('{"_index":"%s","_type":"%s","_id":"%d","_score":1.0,'
+                '"_source":{"id":%d,"text":"%s"}}' %
+                (index, self.doctype, docid, docid, self._text)
+                ).encode('utf-8')
+
+    def _hits(self, indexes, start, size):
+        """Return the JSON of the hits start to start + size of the
+        documents of indexes, one index after the other."""
+        total = self.doc_count * len(indexes)
+        hits = []
+        for position in range(start, min(start + size, total)):
+            index, docid = divmod(position, self.doc_count)
+            hits.append(self._hit(indexes[index], docid))
+        return b'[' + b','.join(hits) + b']'
+
+    def _search_response(self, indexes, start, size, scroll_id=None):
+        head = '{"took":1,"timed_out":false,'
+        if scroll_id is not None:
+            head += '"_scroll_id":"%s",' % scroll_id
+        head += ('"_shards":{"total":1,"successful":1,"failed":0},'
+                 '"hits":{"total":%d,"max_score":1.0,"hits":' %
+                 (self.doc_count * len(indexes)))
+        return (head.encode('utf-8') + self._hits(indexes, start, size) +
+                b'}}')
+
+    def _scroll(self, body):
+        scroll_id = body.decode('utf-8').strip()
+        if scroll_id.startswith('{'):
+            scroll_id = json.loads(scroll_id)['scroll_id']
+        with self.lock:
+            state = self.scrolls.get(scroll_id)
+            if state is None:
+                return 404, {'error': 'SearchContextMissingException'}
+            indexes, start, size = state
+            self.scrolls[scroll_id] = (indexes, start + size, size)
+        return 200, self._search_response(indexes, start, size, scroll_id)
+
+    def _search(self, parts, args, body):
+        indexes = self._select(parts[0] if len(parts) > 1 else None)
+        if indexes is None:
+            return 404, {'error': 'IndexMissingException', 'status': 404}
+        query = json.loads(body.decode('utf-8')) if body.strip() else {}
+        size = int(args.get('size', query.get('size', 10)))
+        if parts[-1] == '_count':
+            return 200, {'count': self.doc_count * len(indexes)}
+        if 'scroll' not in args:
+            return 200, self._search_response(indexes, 0, size)
+        scroll_id = 'scroll%d' % next(self.scroll_ids)
+        # A scan search returns no hits with the first response
+        start = 0 if args.get('search_type') == 'scan' else size
+        with self.lock:
+            self.scrolls[scroll_id] = (indexes, start, size)
+        return 200, self._search_response(indexes, 0, start, scroll_id)
+
+    def _bulk(self, body):
+        items = []
+        lines = iter(body.split(b'\n'))
+        for line in lines:
+            if not line.strip():
+                continue
+            action = json.loads(line.decode('utf-8'))
+            op_type, meta = list(action.items())[0]
+            if op_type != 'delete':
+                next(lines, None)
+            status = 200 if op_type == 'delete' else 201
+            items.append('{"%s":{"_index":"%s","_type":"%s","_id":"%s",'
+                         '"_version":1,"status":%d}}' %
+                         (op_type, meta.get('_index'), meta.get('_type'),
+                          meta.get('_id'), status))
+        return 200, ('{"took":1,"errors":false,"items":[%s]}' %
+                     ','.join(items)).encode('utf-8')
+
+    def _document(self, index, docid):
+        try:
+            number = int(docid)
+        except ValueError:
+            number = -1
+        if index not in self.indexes or not 0 <= number < self.doc_count:
+            return ('{"_index":"%s","_type":"%s","_id":"%s","found":false}' %
+                    (index, self.doctype, docid)).encode('utf-8')
+        return self._hit(index, number)[:-1] + b',"found":true}'
+
+    def _mget(self, parts, body):
+        request = json.loads(body.decode('utf-8'))
+        docs = []
+        for doc in request['docs']:
+            index = doc.get('_index', parts[0] if len(parts) > 1 else None)
+            docs.append(self._document(index, doc['_id']))
+        return 200, b'{"docs":[' + b','.join(docs) + b']}'
+
+    def _msearch(self, body):
+        lines = [line for line in body.split(b'\n') if line.strip()]
+        responses = []
+        for header in lines[::2]:
+            header = json.loads(header.decode('utf-8'))
+            indexes = self._select(header.get('index'))
+            if indexes is None:
+                responses.append(b'{"error":"IndexMissingException"}')
+            else:
+                responses.append(self._search_response(indexes, 0, 10))
+        return 200, b'{"responses":[' + b','.join(responses) + b']}'
+
+    def respond(self, method, parts, args, body):
+        """Return the status and the response body for a request."""
+        name = method
+        for part in reversed(parts):
+            if part.startswith('_'):
+                name = part
+                break
+        self._count(name)
+
+        if parts[:2] == ['_search', 'scroll']:
+            if method == 'DELETE':
+                return 200, {'succeeded': True}
+            return self._scroll(body)
+        if parts and parts[-1] in ('_search', '_count'):
+            return self._search(parts, args, body)
+        if parts and parts[-1] == '_bulk':
+            return self._bulk(body)
+        if parts and parts[-1] == '_mget':
+            return self._mget(parts, body)
+        if parts and parts[-1] == '_msearch':
+            return self._msearch(body)
+        if parts and parts[-1] == '_mapping' and method == 'GET':
+            indexes = self._select(parts[0] if len(parts) > 1 else None)
+            properties = {'id': {'type': 'long'},
+                          'text': {'type': 'string'}}
+            return 200, dict((index, {'mappings': {self.doctype: {
+                'properties': properties}}}) for index in indexes or [])
+        if parts and parts[-1] == '_settings':
+            indexes = self._select(parts[0] if len(parts) > 1 else None)
+            settings = {'index': {'number_of_shards': '1',
+                                  'number_of_replicas': '0'}}
+            return 200, dict((index, {'settings': settings})
+                             for index in indexes or [])
+        if parts and parts[-1].startswith('_'):
+            # _refresh, _flush, _mapping, _aliases, ...
+            return 200, {'acknowledged': True, 'ok': True}
+        if not parts:
+            return 200, {'status': 200, 'version': {'number': '1.7.5'}}
+        if len(parts) == 1:
+            found = parts[0] in self.indexes
+            if method == 'HEAD':
+                return (200 if found else 404), b''
+            return 200, {'acknowledged': True, 'ok': True}
+        if method in ('PUT', 'POST'):
+            docid = parts[2] if len(parts) > 2 else str(next(self.scroll_ids))
+            return 201, {'_index': parts[0], '_type': parts[1],
+                         '_id': docid, '_version': 1, 'created': True}
+        if method == 'GET' and len(parts) == 3:
+            document = self._document(parts[0], parts[2])
+            return (200 if b'"found":true' in document else 404), document
+        if method == 'DELETE' and len(parts) == 3:
+            return 200, {'found': True, '_index': parts[0],
+                         '_type': parts[1], '_id': parts[2], '_version': 2}
+        return 400, {'error': 'Unsupported request %s /%s' %
+                     (method, '/'.join(parts))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock ElasticSearch "
+                                     "server for benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9250)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds to wait before every response")
+    parser.add_argument('--docs', type=int, default=10000,
+                        help="The number of documents per index")
+    parser.add_argument('--doc-size', type=int, default=200,
+                        help="The size in bytes of a document source")
+    parser.add_argument('--indexes', nargs='+', default=['bench'])
+    arguments = parser.parse_args()
+    mock = MockElasticsearch(arguments.host, arguments.port,
+                             latency=arguments.latency,
+                             doc_count=arguments.docs,
+                             doc_size=arguments.doc_size,
+                             indexes=arguments.indexes)
+    print("Listening on %s" % mock.url)
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
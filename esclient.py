@@ -1,5 +1,6 @@
 from __future__ import print_function
 import requests
+import requests.adapters
 try:
     from urllib import urlencode, quote_plus
 except ImportError:
@@ -11,12 +12,37 @@ try:
     import simplejson as json   # try the faster simplejson on old versions
 except:
     import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+import bisect
 import logging
+import random
+import re
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from fnmatch import fnmatch
+import time
+import zlib
 log = logging.getLogger(__name__)
 
 __author__ = 'Erik-Jan van Baaren'
-__all__ = ['ESClient']
-__version__ = (0, 5, 8)
+__all__ = ['ESClient', 'BulkBuffer', 'BulkResult', 'JSONCodec', 'get_codec',
+           'NodePool', 'RetryPolicy', 'ResponseCache', 'SingleFlight',
+           'GetLoader', 'MultiSearchError', 'HitsParser', 'HitStream',
+           'Metrics', 'Histogram']
+__version__ = (0, 6, 0)
 
 
 def get_version():
@@ -27,17 +53,1058 @@ def _utf8_encode(component):
     return component.encode("utf-8")
 
 
+def _normalize_url(url):
+    if url.endswith('/'):
+        url = url[:-1]
+
+    # For those that forget the http part, lets just add it
+    if '://' not in url:
+        url = "http://" + url
+    return url
+
+
+def _to_bytes(data):
+    if isinstance(data, bytes):
+        return data
+    return data.encode("utf-8")
+
+
+if bytes is str:
+    def _plain_buffers(buffers):
+        """Python 2 can not join or compress memoryviews and bytearrays,
+        so they are copied to strings there."""
+        return [buffer.tobytes() if isinstance(buffer, memoryview)
+                else bytes(buffer) for buffer in buffers]
+else:
+    def _plain_buffers(buffers):
+        return list(buffers)
+
+
+def _gzip(data, level=6):
+    """Compress data, bytes or a list of buffers, in the gzip format."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = [data]
+    data = _plain_buffers(data)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = [compressor.compress(buffer) for buffer in data]
+    compressed.append(compressor.flush())
+    return b''.join(compressed)
+
+
+def _buffers(data):
+    """Return the buffers of an encoded bulk action, which is either bytes
+    or a tuple of buffers."""
+    if isinstance(data, tuple):
+        return data
+    return (data,)
+
+
+class _BufferBody(object):
+    """A request body made of a list of buffers, which are sent without
+    joining them into one string first.
+
+    Small buffers are joined into pieces of about piece_size bytes, so that
+    the body is not written to the socket a few bytes at a time; larger
+    buffers are sent as they are. A body can be sent more than once, e.g.
+    when a request is retried.
+
+    """
+    piece_size = 64 * 1024
+
+    def __init__(self, actions):
+        self.buffers = _plain_buffers(buffer for data in actions
+                                      for buffer in _buffers(data))
+        self.size = sum(len(buffer) for buffer in self.buffers)
+
+    def __len__(self):
+        # requests uses this as the Content-Length
+        return self.size
+
+    def __iter__(self):
+        piece = []
+        size = 0
+        for buffer in self.buffers:
+            if len(buffer) >= self.piece_size:
+                if piece:
+                    yield b''.join(piece)
+                    piece = []
+                    size = 0
+                yield buffer
+                continue
+            piece.append(buffer)
+            size += len(buffer)
+            if size >= self.piece_size:
+                yield b''.join(piece)
+                piece = []
+                size = 0
+        if piece:
+            yield b''.join(piece)
+
+    def getvalue(self):
+        return b''.join(self.buffers)
+
+
+# The types of bulk sources that are JSON already. On Python 2 a str is a
+# document that is a string, as it was before sources could be JSON.
+if bytes is str:
+    _JSON_BUFFERS = (bytearray, memoryview)
+else:
+    _JSON_BUFFERS = (bytes, bytearray, memoryview)
+
+# json.loads() only accepts bytes since Python 3.6
+_LOADS_BYTES = bytes is str or sys.version_info >= (3, 6)
+
+# time.monotonic() does not exist on Python 2
+_now = getattr(time, 'monotonic', time.time)
+
+
+# Bulk item statuses that are worth sending again: the bulk queue of the node
+# was full or the node was temporarily unavailable.
+RETRYABLE_BULK_STATUSES = (429, 503)
+
+
 class ESClientException(Exception):
     pass
 
 
-class ESClient:
+class MultiSearchError(ESClientException):
+    """Raised by msearch() when one or more of the searches failed.
+
+    responses holds the responses of all searches, in order, and errors
+    maps the position of every failed search to its error.
+
+    """
+
+    def __init__(self, responses, errors):
+        ESClientException.__init__(self, "%d of %d searches failed: %s" %
+                                   (len(errors), len(responses), errors))
+        self.responses = responses
+        self.errors = errors
+
+
+class JSONCodec(object):
+    """Converts request bodies to JSON and responses from JSON.
+
+    A codec works on bytes in both directions, so responses do not have to
+    be decoded to text first. This codec uses simplejson when it is
+    installed and the json module otherwise. Subclass it to plug in another
+    JSON library and pass an instance as the codec of an ESClient.
+
+    """
+    name = 'json'
+
+    def dumps(self, obj):
+        """Return obj as JSON bytes."""
+        return _to_bytes(json.dumps(obj))
+
+    def loads(self, data):
+        """Return the Python objects for the JSON in data (bytes)."""
+        if not _LOADS_BYTES and isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """A codec that uses the orjson library."""
+    name = 'orjson'
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(JSONCodec):
+    """A codec that uses the ujson library."""
+    name = 'ujson'
+
+    def dumps(self, obj):
+        return _to_bytes(ujson.dumps(obj))
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+class Node(object):
+    """An ElasticSearch node as tracked by a NodePool."""
+
+    def __init__(self, url):
+        self.url = url
+        self.in_flight = 0
+        self.failures = 0
+        self.dead_until = 0
+
+    def __repr__(self):
+        return "<Node %s>" % self.url
+
+
+class NodePool(object):
+    """Keeps track of the ElasticSearch nodes of a client and selects the
+    node for every request.
+
+    The strategy is one of 'round_robin', 'random' and 'least_in_flight'
+    (the node with the fewest requests in progress). A node that fails is
+    marked dead and is not selected for dead_timeout seconds, doubled for
+    every consecutive failure up to max_dead_timeout. When all nodes are
+    dead, the node that is expected to come back first is used anyway.
+
+    """
+
+    STRATEGIES = ('round_robin', 'random', 'least_in_flight')
+
+    def __init__(self, urls, strategy='round_robin', dead_timeout=60,
+                 max_dead_timeout=3600):
+        if strategy not in self.STRATEGIES:
+            raise ESClientException("Unknown node selection strategy '%s'" %
+                                    strategy)
+        self.strategy = strategy
+        self.dead_timeout = dead_timeout
+        self.max_dead_timeout = max_dead_timeout
+        self.lock = threading.Lock()
+        self.nodes = []
+        self._counter = 0
+        self.set_nodes(urls)
+
+    def set_nodes(self, urls):
+        """Replace the list of nodes. Nodes that were already known keep
+        their state."""
+        urls = [_normalize_url(url) for url in urls]
+        if not urls:
+            raise ESClientException("At least one node is required")
+        with self.lock:
+            known = dict((node.url, node) for node in self.nodes)
+            self.nodes = [known.get(url) or Node(url) for url in urls]
+
+    def get(self):
+        """Select a node for a request and count it as in flight. Every
+        get() must be followed by a release()."""
+        with self.lock:
+            now = _now()
+            live = [node for node in self.nodes if node.dead_until <= now]
+            if not live:
+                node = min(self.nodes, key=lambda node: node.dead_until)
+            elif self.strategy == 'random':
+                node = random.choice(live)
+            elif self.strategy == 'least_in_flight':
+                node = min(live, key=lambda node: node.in_flight)
+            else:
+                node = live[self._counter % len(live)]
+                self._counter += 1
+            node.in_flight += 1
+            return node
+
+    def release(self, node, success=True):
+        """Mark the request on node as done. When it failed, the node is
+        marked dead."""
+        with self.lock:
+            node.in_flight -= 1
+            if success:
+                node.failures = 0
+                node.dead_until = 0
+            else:
+                node.failures += 1
+                timeout = min(self.dead_timeout * 2 ** (node.failures - 1),
+                              self.max_dead_timeout)
+                node.dead_until = _now() + timeout
+                log.warning("Marking node %s dead for %d seconds",
+                            node.url, timeout)
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class RetryPolicy(object):
+    """Decides which failed requests are sent again, and when.
+
+    A request is retried when it raised one of retry_on_exceptions or
+    returned one of the retry_on_status codes, as long as fewer than
+    max_attempts attempts were made. When max_attempts is None, every node
+    of the client is tried once.
+
+    By default only requests that could not connect are retried. A request
+    that timed out while waiting for the response may have been executed
+    by ElasticSearch, and sending it again could e.g. index a document
+    twice, so read timeouts are only retried with retry_on_timeout=True.
+
+    Before retry number n the client waits backoff_factor * 2 ** (n - 1)
+    seconds, at most max_backoff, of which a random fraction of up to
+    jitter is left out so that clients do not retry in lockstep.
+
+    deadline is the maximum number of seconds one call may take, including
+    all retries. The timeout of every attempt is shortened to fit in it, and
+    no retry is started that would end after it.
+
+    """
+
+    def __init__(self, max_attempts=3, backoff_factor=0.1, max_backoff=10,
+                 jitter=0.5, retry_on_status=(429, 502, 503, 504),
+                 retry_on_exceptions=(requests.ConnectionError,),
+                 retry_on_timeout=False, deadline=None):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on_status = tuple(retry_on_status)
+        self.retry_on_exceptions = tuple(retry_on_exceptions)
+        self.retry_on_timeout = retry_on_timeout
+        self.deadline = deadline
+
+    def retries(self, error):
+        """Return True if a request that raised error should be retried."""
+        if isinstance(error, requests.Timeout) and \
+                not isinstance(error, requests.ConnectionError):
+            # A read timeout; a connect timeout is a ConnectionError as well
+            return self.retry_on_timeout
+        return isinstance(error, self.retry_on_exceptions)
+
+    def backoff(self, retry):
+        """Return the number of seconds to wait before retry number retry."""
+        delay = min(self.backoff_factor * 2 ** (retry - 1), self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+
+def _bulk_retry_policy(max_retries, backoff, policy=None):
+    """Return the RetryPolicy for resending rejected bulk actions: up to
+    max_retries retries, starting at backoff seconds, with the jitter,
+    max_backoff and deadline of policy, the policy of the client."""
+    if policy is None:
+        policy = RetryPolicy()
+    return RetryPolicy(max_attempts=max_retries + 1, backoff_factor=backoff,
+                       max_backoff=policy.max_backoff, jitter=policy.jitter,
+                       deadline=policy.deadline)
+
+
+def _bulk_retry_delay(policy, attempts, deadline):
+    """Return the number of seconds to wait before resending the rejected
+    actions of a bulk request that was sent attempts times, or None when
+    they may not be resent."""
+    if attempts >= policy.max_attempts:
+        return None
+    delay = policy.backoff(attempts)
+    if deadline is not None and _now() + delay >= deadline:
+        return None
+    return delay
+
+
+class ResponseCache(object):
+    """A cache for the responses of read requests (search, count, get and
+    mget), used by ESClient when it is created with a cache.
+
+    Responses are evicted least recently used first when there are more
+    than max_entries of them or they take more than max_bytes, and expire
+    ttl seconds after they were stored. Only successful responses are
+    cached.
+
+    ESClient invalidates the entries for an index when it writes to that
+    index (index, delete, bulk, refresh, ...). Entries for _all and for
+    wildcard patterns that match the index are invalidated too, and a
+    write to _all or to a pattern invalidates the entries of every index
+    it matches. The client does not know which aliases point to an index:
+    reads through an alias can be stale for up to ttl seconds after a
+    write.
+
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=10 * 1024 * 1024, ttl=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(method, path, query_string_args, body):
+        """Return the cache key for a request. Query string arguments and
+        body are canonicalized, so the order of keys does not matter."""
+        if query_string_args:
+            query = urlencode(sorted(query_string_args.items()))
+        else:
+            query = ''
+        if body is not None:
+            body = json.dumps(body, sort_keys=True, separators=(',', ':'))
+        return (method.upper(), path, query, body)
+
+    def get(self, key):
+        """Return the cached response for key, or None."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] <= _now():
+                if entry is not None:
+                    self.size -= len(entry[2].content)
+                self.misses += 1
+                return None
+            # Move the entry to the end, as most recently used
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, indexes, response):
+        """Store a response, together with the index names or patterns it
+        was read from."""
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[2].content)
+            self.entries[key] = (_now() + self.ttl, tuple(indexes), response)
+            self.size += size
+            while len(self.entries) > self.max_entries or \
+                    self.size > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted.content)
+
+    def invalidate(self, indexes=None):
+        """Remove the entries that may contain data of the given indexes,
+        or all entries if indexes is None."""
+        with self.lock:
+            if indexes is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            for key, (_, patterns, response) in list(self.entries.items()):
+                if self._matches(patterns, indexes):
+                    del self.entries[key]
+                    self.size -= len(response.content)
+
+    @staticmethod
+    def _matches(patterns, indexes):
+        # Both sides can be _all or a wildcard pattern, e.g. a search of
+        # _all or a delete_index('logs-*')
+        for index in indexes:
+            if index in ('', '_all', '*'):
+                return True
+        for pattern in patterns:
+            if pattern in ('', '_all'):
+                return True
+            for index in indexes:
+                if fnmatch(index, pattern) or fnmatch(pattern, index):
+                    return True
+        return False
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class _Future(object):
+    """The result of a call that is made by another thread."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, error):
+        self._error = error
+        self._done.set()
+
+    def result(self):
+        """Wait for the call to finish and return its result, or raise its
+        exception."""
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class SingleFlight(object):
+    """Makes concurrent identical calls share a single execution.
+
+    While a call for a key is in progress, other callers of do() with the
+    same key wait for that call and get its result (or exception) instead
+    of making the call themselves. Unlike a cache, nothing is kept once the
+    call has finished.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.shared = 0
+
+    def do(self, key, function):
+        """Call function(), unless a call for key is already in progress,
+        and return its result."""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = _Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+class GetLoader(object):
+    """Collects single document gets from many threads and fetches them
+    with one multi get request.
+
+    The first get() of a batch waits up to window seconds for other gets
+    to join it, or until max_batch gets are collected, and then sends them
+    all with ESClient.get_many(). Every caller gets the result for its own
+    document, in the same format as ESClient.get().
+
+    Arguments:
+        client -- the ESClient to fetch the documents with
+        max_batch -- the maximum number of documents per multi get
+        window -- the time in seconds to wait for more gets
+
+    """
+
+    def __init__(self, client, max_batch=100, window=0.005):
+        self.client = client
+        self.max_batch = max_batch
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = None
+        self.batches = 0
+
+    def get(self, index, doctype, docid, fields=None):
+        """Get a document, together with the gets of other threads."""
+        doc = {'_index': index, '_type': doctype, '_id': str(docid)}
+        if fields:
+            doc['fields'] = fields
+        future = _Future()
+        with self.lock:
+            leader = self.pending is None
+            if leader:
+                self.pending = ([], threading.Event())
+            batch, full = self.pending
+            batch.append((doc, future))
+            if len(batch) >= self.max_batch:
+                self.pending = None
+                full.set()
+        if leader:
+            full.wait(self.window)
+            with self.lock:
+                if self.pending is not None and self.pending[0] is batch:
+                    self.pending = None
+                self.batches += 1
+            self._fetch(batch)
+        return future.result()
+
+    def _fetch(self, batch):
+        try:
+            docs = self.client.get_many([doc for doc, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), doc in zip(batch, docs):
+            future.set_result(doc)
+        # The response had fewer docs than were asked for; the callers of
+        # the missing ones must not wait forever
+        for _, future in batch[len(docs):]:
+            future.set_exception(ESClientException(
+                "The multi get response has %d docs, expected %d" %
+                (len(docs), len(batch))))
+
+
+# The upper bounds in seconds of the buckets of a Histogram
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram(object):
+    """Counts durations in buckets with fixed upper bounds.
+
+    Percentiles are estimated by interpolating within the bucket they fall
+    in, so they are as precise as the buckets are narrow. Not thread safe;
+    Metrics takes care of the locking.
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        # The last count is for the values above the last bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Return the estimated value below which the given fraction (e.g.
+        0.99) of the values fall, or None when there are no values."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        lower = self.min
+        for bound, count in zip(self.bounds + (self.max,), self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                lower = max(lower, self.min)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def snapshot(self):
+        """Return the histogram as a dict. buckets lists [bound, count]
+        pairs, where count is the number of values of at most bound, as
+        Prometheus does; count includes the values above the last bound."""
+        buckets = []
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            buckets.append([bound, seen])
+        return {'count': self.count, 'sum': self.sum, 'min': self.min,
+                'max': self.max, 'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9), 'p99': self.percentile(0.99),
+                'buckets': buckets}
+
+
+class Metrics(object):
+    """Collects timings and counters of the requests made by an ESClient,
+    per operation.
+
+    An operation is what a request does, as derived from its method and
+    path: 'index', 'get', 'delete', 'search', 'count', 'scroll', 'bulk',
+    'mget', 'msearch', 'refresh', etc. For every operation there is a
+    Histogram for each of the phases of a request:
+
+    serialize -- encoding (and compressing) the request body
+    network -- sending the request and receiving the response, summed over
+               all attempts. For streamed responses only up to the headers.
+    parse -- decoding the JSON response. Streamed responses and responses
+             from the cache are not measured.
+
+    and these counters: requests, errors (requests that raised or returned
+    a status of 400 or higher), retries, bytes_sent, bytes_received, and
+    for bulk requests items, items_failed and items_retried.
+
+    Use snapshot() to export them. One Metrics instance may be shared by
+    several clients.
+
+    """
+
+    PHASES = ('serialize', 'network', 'parse')
+    COUNTERS = ('requests', 'errors', 'retries', 'bytes_sent',
+                'bytes_received', 'items', 'items_failed', 'items_retried')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop everything that was collected."""
+        with self.lock:
+            self.operations = {}
+            self.started = _now()
+
+    def _operation(self, name):
+        # The lock must be held
+        operation = self.operations.get(name)
+        if operation is None:
+            operation = dict.fromkeys(self.COUNTERS, 0)
+            for phase in self.PHASES:
+                operation[phase] = Histogram(self.buckets)
+            self.operations[name] = operation
+        return operation
+
+    def observe(self, operation, phase, seconds):
+        """Add the duration of a phase of an operation."""
+        with self.lock:
+            self._operation(operation)[phase].observe(seconds)
+
+    def add(self, operation, **counters):
+        """Add to the counters of an operation, e.g.
+        add('bulk', items=500)."""
+        with self.lock:
+            values = self._operation(operation)
+            for name, value in counters.items():
+                values[name] += value
+
+    def record(self, request):
+        """Add a request as passed to the after_request hooks of
+        ESClient."""
+        status = request.get('status')
+        failed = request.get('error') is not None or \
+            (status is not None and status >= 400)
+        with self.lock:
+            values = self._operation(request['operation'])
+            values['requests'] += 1
+            values['errors'] += failed and 1 or 0
+            values['retries'] += max(request['attempts'] - 1, 0)
+            values['bytes_sent'] += request['bytes_sent']
+            values['bytes_received'] += request.get('bytes_received') or 0
+            values['serialize'].observe(request['serialize'])
+            values['network'].observe(request['network'])
+
+    def snapshot(self):
+        """Return everything collected so far as a dict of plain values,
+        which can be encoded as JSON:
+
+        {'elapsed': seconds since the start or last reset,
+         'operations': {'search': {'requests': 10, ...,
+                                   'network': {'count': 10, 'p99': ...},
+                                   ...}}}
+
+        Rates, such as bulk items per second, are the counters divided by
+        the elapsed time.
+
+        """
+        with self.lock:
+            operations = {}
+            for name, values in self.operations.items():
+                result = dict((counter, values[counter])
+                              for counter in self.COUNTERS)
+                for phase in self.PHASES:
+                    result[phase] = values[phase].snapshot()
+                operations[name] = result
+            return {'elapsed': _now() - self.started,
+                    'operations': operations}
+
+
+def _operation_name(method, path):
+    """Return the name under which Metrics counts a request, e.g. 'search'
+    for GET /contacts/_search."""
+    parts = [part for part in path.split('?')[0].split('/') if part]
+    if parts[:2] == ['_search', 'scroll']:
+        return 'scroll'
+    for part in reversed(parts):
+        if part.startswith('_'):
+            return part[1:]
+    if len(parts) >= 2:
+        # A document
+        return {'GET': 'get', 'HEAD': 'exists',
+                'DELETE': 'delete'}.get(method, 'index')
+    if parts:
+        return {'PUT': 'create_index', 'DELETE': 'delete_index',
+                'HEAD': 'index_exists'}.get(method, 'index_info')
+    return 'info'
+
+
+def _parse_publish_address(address, scheme='http'):
+    """Return the URL for a node address as listed by the nodes info API,
+    e.g. "inet[/127.0.0.1:9200]" or "hostname/127.0.0.1:9200".
+
+    The address does not say whether the node speaks HTTPS, so the URL gets
+    the given scheme, the one of the nodes the client was created with.
+
+    """
+    if address.startswith('inet[') and address.endswith(']'):
+        address = address[5:-1]
+    # Drop the host name in front of the IP address
+    address = address.split('/')[-1]
+    if not address:
+        return None
+    return scheme + "://" + address
+
+
+def get_codec(codec='json'):
+    """Return a JSON codec.
+
+    codec may be a codec instance, which is returned as is, or one of the
+    names 'json', 'orjson' and 'ujson'. The name 'auto' selects the fastest
+    codec of which the library is installed.
+
+    Only the json codec handles integers of any size. orjson and ujson are
+    limited to 64 bits: orjson decodes larger integers as floats, which
+    loses digits, and both refuse to encode them.
+
+    """
+    if isinstance(codec, JSONCodec):
+        return codec
+    available = [('orjson', orjson, OrjsonCodec),
+                 ('ujson', ujson, UjsonCodec),
+                 ('json', json, JSONCodec)]
+    for name, module, codec_class in available:
+        if codec in (name, 'auto') and module is not None:
+            return codec_class()
+    raise ESClientException("JSON codec '%s' is not available" % codec)
+
+
+class BulkBuffer(object):
+    """Collects encoded bulk actions until they are sent to ElasticSearch.
+
+    Every action (the action line plus the optional source line) is kept as
+    a separate bytes chunk, or a tuple of buffers, so adding an action never
+    copies the actions that were added before it. The buffers are sent one
+    after the other, without joining them into one request body.
+
+    A buffer is full when it holds max_actions actions, max_bytes bytes, or
+    when the first action in it is older than max_age seconds. Each of these
+    limits is optional. Note that the age is only checked when an action is
+    added; there is no background timer.
+
+    """
+
+    def __init__(self, max_actions=None, max_bytes=None, max_age=None):
+        self.max_actions = max_actions
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # The BulkResult of the final push, set by ESClient.bulk_context()
+        self.result = None
+        self.clear()
+
+    def clear(self):
+        """Remove all actions from the buffer."""
+        self.actions = []
+        self.indexes = set()
+        self.size = 0
+        self.created = None
+
+    def append(self, data, index=None):
+        """Add one encoded action, for the given index, to the buffer. data
+        is bytes or a tuple of buffers, e.g. bytes and memoryviews."""
+        if not self.actions:
+            self.created = _now()
+        self.actions.append(data)
+        if isinstance(data, tuple):
+            self.size += sum(len(buffer) for buffer in data)
+        else:
+            self.size += len(data)
+        if index is not None:
+            self.indexes.add(index)
+
+    def is_full(self):
+        """Return True if one of the configured limits has been reached."""
+        if not self.actions:
+            return False
+        if self.max_actions and len(self.actions) >= self.max_actions:
+            return True
+        if self.max_bytes and self.size >= self.max_bytes:
+            return True
+        if self.max_age is not None and \
+                _now() - self.created >= self.max_age:
+            return True
+        return False
+
+    def getvalue(self):
+        """Return the bulk request body as bytes."""
+        return _BufferBody(self.actions).getvalue()
+
+    def __len__(self):
+        return len(self.actions)
+
+
+class BulkResult(object):
+    """The outcome of one or more bulk requests.
+
+    succeeded and failed are lists with one dict per action, as returned by
+    ElasticSearch in the items of the bulk response. Every dict also contains
+    the op_type of the action and, under the key 'action', the action as it
+    was added to the request. took is the sum of the took of the bulk
+    responses, in milliseconds, and attempts the number of bulk requests
+    that were sent, including retries.
+
+    A BulkResult is true when no action failed, so it can be used the same
+    way as the boolean that bulk_push() returned in earlier versions.
+
+    """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+        self.status_code = None
+        self.took = 0
+        self.attempts = 0
+
+    @property
+    def errors(self):
+        return bool(self.failed)
+
+    def __bool__(self):
+        return not self.failed
+
+    __nonzero__ = __bool__
+
+    def __len__(self):
+        return len(self.succeeded) + len(self.failed)
+
+    def __repr__(self):
+        return "<BulkResult succeeded=%d failed=%d>" % (len(self.succeeded),
+                                                      len(self.failed))
+
+
+class HitsParser(object):
+    """Incremental parser for search responses.
+
+    Data fed to the parser is scanned for the elements of the hits.hits
+    array, which are returned as raw JSON as soon as they are complete.
+    Everything else is collected in rest, with an empty hits.hits array,
+    and can be parsed when the response has been fed completely. Only one
+    hit is kept in memory at a time.
+
+    """
+    TOKEN = re.compile(b'["{}\\[\\]:]')
+    STRING_END = re.compile(b'["\\\\]')
+
+    def __init__(self):
+        self.stack = []
+        self.key = None
+        self.last_string = None
+        self.string = None
+        self.in_string = False
+        self.escape = False
+        # Where the data goes: 'rest', 'hit' or None between the hits
+        self.sink = 'rest'
+        self.hits_depth = None
+        self.hit = []
+        self.rest = []
+
+    def feed(self, data):
+        """Scan the next piece of the response and return a list with the
+        raw JSON of the hits that were completed."""
+        hits = []
+        position = 0
+        start = 0
+        while True:
+            if self.in_string:
+                if self.escape:
+                    if position >= len(data):
+                        break
+                    if self.string is not None:
+                        self.string.append(data[position:position + 1])
+                    position += 1
+                    self.escape = False
+                match = self.STRING_END.search(data, position)
+                if match is None:
+                    if self.string is not None:
+                        self.string.append(data[position:])
+                    break
+                if match.group() == b'\\':
+                    self.escape = True
+                    if self.string is not None:
+                        self.string.append(data[position:match.end()])
+                    position = match.end()
+                    continue
+                self.in_string = False
+                if self.string is not None:
+                    self.string.append(data[position:match.start()])
+                    self.last_string = b''.join(self.string)
+                    self.string = None
+                position = match.end()
+                continue
+
+            match = self.TOKEN.search(data, position)
+            if match is None:
+                break
+            token = match.group()
+            position = match.end()
+            if token == b'"':
+                self.in_string = True
+                # Only keys near the top are needed
+                if self.sink == 'rest' and len(self.stack) <= 2:
+                    self.string = []
+            elif token == b':':
+                self.key = self.last_string
+            elif token in b'{[':
+                key, self.key = self.key, None
+                self.stack.append((token, key))
+                depth = len(self.stack)
+                if depth == 3 and token == b'[' and key == b'hits' and \
+                        self.stack[1] == (b'{', b'hits'):
+                    # The hits array itself stays in rest, empty
+                    self._flush(data, start, position)
+                    start = position
+                    self.sink = None
+                    self.hits_depth = depth
+                elif self.sink is None and depth == self.hits_depth + 1:
+                    start = match.start()
+                    self.sink = 'hit'
+            else:
+                self.stack.pop()
+                depth = len(self.stack)
+                if self.sink == 'hit' and depth == self.hits_depth:
+                    self.hit.append(data[start:position])
+                    hits.append(b''.join(self.hit))
+                    self.hit = []
+                    start = position
+                    self.sink = None
+                elif self.sink is None and depth == self.hits_depth - 1:
+                    start = match.start()
+                    self.sink = 'rest'
+                    self.hits_depth = None
+        self._flush(data, start, len(data))
+        return hits
+
+    def _flush(self, data, start, end):
+        if self.sink == 'rest':
+            self.rest.append(data[start:end])
+        elif self.sink == 'hit':
+            self.hit.append(data[start:end])
+
+
+class HitStream(object):
+    """The hits of a search response, parsed while the response is being
+    received.
+
+    Iterating over a HitStream yields the hits one at a time. Afterwards,
+    the result attribute holds the rest of the response, e.g. the
+    _scroll_id and hits.total, with an empty hits.hits list. The stream
+    should be iterated completely or closed, to release the connection.
+
+    """
+
+    def __init__(self, response, codec, chunk_size=64 * 1024):
+        self.response = response
+        self.codec = codec
+        self.chunk_size = chunk_size
+        self.result = None
+
+    def __iter__(self):
+        parser = HitsParser()
+        try:
+            for data in self.response.iter_content(self.chunk_size):
+                for hit in parser.feed(data):
+                    yield self.codec.loads(hit)
+        finally:
+            self.close()
+        rest = b''.join(parser.rest)
+        try:
+            self.result = self.codec.loads(rest)
+        except Exception:
+            raise ESClientException("Unable to parse JSON response from "
+                                    "ElasticSearch: %r" % rest[:1000])
+
+    def close(self):
+        self.response.close()
+
+
+class ESClient(object):
     """ESClient is a Python library that wraps around the ElasticSearch
     REST API.
 
     ESClient methods will always return a hierachy of Python objects and not
     the pure JSON as returned by ElasticSearch.
 
+    One client can be shared by several threads: every request returns its
+    own response, and every thread has its own bulk buffer.
+
     Take a look at the unit tests to see usage examples for all available API
     methods that this library implements.
     Any API calls that are not (yet) implemented by ESClient can still be used
@@ -46,17 +1113,198 @@ class ESClient:
 
     """
 
-    def __init__(self, es_url='http://localhost:9200', request_timeout=10):
-        self.es_url = es_url
+    def __init__(self, es_url='http://localhost:9200', request_timeout=10,
+                 pool_connections=10, pool_maxsize=10, pool_block=False,
+                 keep_alive=True, bulk_max_actions=None, bulk_max_bytes=None,
+                 bulk_max_age=None, track_last_response=False, codec='json',
+                 node_selector='round_robin', dead_timeout=60,
+                 sniff_on_start=False, sniff_interval=None, retry_policy=None,
+                 cache=None, coalesce_requests=False, compression=False,
+                 compression_level=6, compression_threshold=1024,
+                 metrics=None):
+        """Create a new client.
+
+        All requests made by this client share one HTTP session, so TCP
+        connections to ElasticSearch are kept alive and reused between calls.
+
+        Arguments:
+        es_url -- the URL of the ElasticSearch server, or a list of URLs of
+                  several nodes of the same cluster
+        request_timeout -- timeout in seconds for a single HTTP request
+        pool_connections -- the number of connection pools to cache, one per
+                            host
+        pool_maxsize -- the maximum number of connections to keep open per
+                        host
+        pool_block -- when True, block when all pool_maxsize connections are
+                      in use instead of opening an extra, unpooled connection
+        keep_alive -- set to False to close the connection after every
+                      request
+        bulk_max_actions, bulk_max_bytes, bulk_max_age -- optional limits
+            for the bulk buffer; bulk_index() and bulk_delete() call
+            bulk_push() automatically when one of them is reached
+        track_last_response -- store the response of every request in the
+            last_response attribute, for debugging. Only useful when the
+            client is used by a single thread.
+        codec -- the JSON codec to use: a JSONCodec instance or one of the
+            names accepted by get_codec(), e.g. 'orjson' or 'auto'
+        node_selector -- how to spread requests over the nodes:
+            'round_robin', 'random' or 'least_in_flight'
+        dead_timeout -- the number of seconds a node that failed is skipped,
+            doubled for every consecutive failure
+        sniff_on_start -- replace the list of nodes by the nodes of the
+            cluster, as listed by the nodes info API
+        sniff_interval -- sniff the nodes again every sniff_interval seconds
+        retry_policy -- a RetryPolicy for failed requests. By default a
+            request that can not reach a node is tried once on every node,
+            without waiting, and error responses and read timeouts are
+            not retried.
+        cache -- a ResponseCache for search, count, get and mget responses,
+            or True for a cache with the default limits. Off by default.
+        coalesce_requests -- let threads that make the same search, count,
+            get or mget request at the same time share one HTTP request
+        compression -- gzip request bodies of at least compression_threshold
+            bytes. Responses are compressed by ElasticSearch when
+            http.compression is enabled, with or without this option.
+        compression_level -- the gzip compression level, from 1 (fastest)
+            to 9 (smallest)
+        compression_threshold -- the minimum size in bytes of a request
+            body to compress
+        metrics -- a Metrics instance to collect the timings and counters
+            of all requests in, or True for a new one. See also
+            add_hook().
+        """
+        if isinstance(es_url, (list, tuple)):
+            urls = es_url
+        else:
+            urls = [es_url]
+        self.node_pool = NodePool(urls, strategy=node_selector,
+                                  dead_timeout=dead_timeout)
+        self.es_url = self.node_pool.nodes[0].url
         self.request_timeout = request_timeout
-        self.bulk_data = ''
+        self.bulk_limits = dict(max_actions=bulk_max_actions,
+                                max_bytes=bulk_max_bytes,
+                                max_age=bulk_max_age)
+        self.track_last_response = track_last_response
+        self.codec = get_codec(codec)
+        self.last_response = None
+        self._local = threading.local()
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            pool_block=pool_block)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_threshold = compression_threshold
+
+        if retry_policy is None:
+            retry_policy = RetryPolicy(max_attempts=None, backoff_factor=0,
+                                       retry_on_status=())
+        self.retry_policy = retry_policy
+
+        if cache is True:
+            cache = ResponseCache()
+        self.cache = cache
+        if coalesce_requests:
+            self.single_flight = SingleFlight()
+        else:
+            self.single_flight = None
+
+        if metrics is True:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.hooks = {'before_request': [], 'after_request': []}
+
+        self.sniff_interval = sniff_interval
+        self._last_sniff = _now()
+        if sniff_on_start:
+            self.sniff_nodes()
+
+    def close(self):
+        """Close all pooled connections of this client."""
+        self.session.close()
+
+    def add_hook(self, event, function):
+        """Call function for every request of this client.
+
+        event is 'before_request' or 'after_request'. Both hooks get a dict
+        that describes the request: operation (see Metrics), method, path,
+        bytes_sent and serialize, the seconds spent encoding the body.
+        after_request hooks get the response as well, or None when the
+        request raised, and the dict then also has network, the seconds
+        spent waiting for the response(s), attempts, status,
+        bytes_received and error, the exception that was raised or None.
+
+        Hooks are called in the thread that makes the request. Exceptions
+        raised by hooks are logged and otherwise ignored.
+
+        """
+        self.hooks[event].append(function)
+
+    def remove_hook(self, event, function):
+        """Remove a hook that was added with add_hook()."""
+        self.hooks[event].remove(function)
+
+    def _run_hooks(self, event, *args):
+        for function in self.hooks[event]:
+            try:
+                function(*args)
+            except Exception:
+                log.exception("%s hook %r failed", event, function)
+
+    def _take_request(self):
+        """Return the description of the last request of this thread once,
+        so that the time to parse its response can be added."""
+        request = getattr(self._local, 'request', None)
+        self._local.request = None
+        return request
+
+    @property
+    def bulk_buffer(self):
+        """The bulk buffer of the current thread."""
+        try:
+            return self._local.bulk_buffer
+        except AttributeError:
+            self._local.bulk_buffer = BulkBuffer(**self.bulk_limits)
+            return self._local.bulk_buffer
+
+    @contextmanager
+    def bulk_context(self, max_actions=None, max_bytes=None, max_age=None):
+        """Collect the bulk actions of a with block in a separate buffer.
+
+        Within the block, bulk_index(), bulk_delete() and bulk_push() of the
+        current thread use a new BulkBuffer, which is yielded. When the
+        block ends without an exception the remaining actions are pushed and
+        the BulkResult is stored as the result attribute of the buffer.
+        The previous buffer of the thread is restored afterwards.
+
+        """
+        previous = self.bulk_buffer
+        buffer = BulkBuffer(max_actions=max_actions, max_bytes=max_bytes,
+                            max_age=max_age)
+        self._local.bulk_buffer = buffer
+        try:
+            yield buffer
+            buffer.result = self.bulk_push()
+        finally:
+            self._local.bulk_buffer = previous
+
+    @property
+    def bulk_data(self):
+        """The pending bulk request body, as a string."""
+        return self.bulk_buffer.getvalue().decode("utf-8")
 
-        if self.es_url.endswith('/'):
-            self.es_url = self.es_url[:-1]
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-        # For those that forget the http part, lets just add it
-        if not self.es_url.startswith('http://'):
-            self.es_url = "http://" + self.es_url
     #
     # Internal helper methods
     #
@@ -80,11 +1328,20 @@ class ESClient:
         Throws an exception when parsing fails.
 
         """
+        request = self._take_request()
+        if request is not None:
+            start = _now()
         try:
-            return json.loads(response)
+            result = self.codec.loads(response)
         except:
             raise ESClientException("Unable to parse JSON response from "
                                     "ElasticSearch")
+        if request is not None:
+            request['parse'] = _now() - start
+            if self.metrics is not None:
+                self.metrics.observe(request['operation'], 'parse',
+                                     request['parse'])
+        return result
 
     def check_result(self, results, key, value):
         """Check if key is an element of list, and check if that element
@@ -100,45 +1357,238 @@ class ESClient:
             log.debug("Key %s not found in response %s" % (key, results))
             return False
 
-    def send_request(self, method, path, body=None, query_string_args={},encode_json=True):
+    def send_request(self, method, path, body=None, query_string_args={},encode_json=True,
+                     stream=False):
         """Make a raw HTTP request to ElasticSearch.
 
         You may use this method to manually do whatever is not (yet) supported
-        by ESClient. This method does not return anything, but sets the class
-        variable called last_response, which is the response object returned
-        by the requests library.
+        by ESClient. This method returns the response object returned by the
+        requests library. If the client was created with
+        track_last_response=True, the response is also stored in the
+        attribute called last_response.
 
         Arguments:
         method -- HTTP method, e.g. 'GET', 'PUT', 'DELETE', etc.
         path -- URL path
         body -- the body, as a hierachy of Python objects that is parseable
-                to JSON with json.dumps()
+                to JSON by the codec of the client, or the encoded body
+                with encode_json=False
         query_string_args -- the query string arguments, which are the
         key=value pairs after the question mark in any URL.
+        encode_json -- set to False when body is already encoded
+        stream -- do not read the response body yet, so that it can be read
+            in pieces with response.iter_content()
+
+        With compression enabled, large bodies are compressed here, so in
+        the thread that sends the request.
 
         """
+        request = None
+        if self.metrics is not None or self.hooks['before_request'] or \
+                self.hooks['after_request']:
+            request = {'operation': _operation_name(method.upper(), path),
+                       'method': method.upper(), 'path': path,
+                       'bytes_sent': 0, 'network': 0.0, 'attempts': 0,
+                       'status': None, 'bytes_received': None,
+                       'error': None}
+            start = _now()
+
         if query_string_args:
             path = "?".join([path, urlencode(query_string_args)])
 
         kwargs = { 'timeout': self.request_timeout }
-        url = self.es_url + path
+        if stream:
+            kwargs['stream'] = True
 
         if body:
             if encode_json:
-                kwargs['data'] = json.dumps(body)
+                kwargs['data'] = self.codec.dumps(body)
             else:
                 kwargs['data'] = body
+            if self.compression:
+                data = kwargs['data']
+                if not isinstance(data, (_BufferBody, bytes, bytearray,
+                                         memoryview)):
+                    data = _to_bytes(data)
+                if len(data) >= self.compression_threshold:
+                    if isinstance(data, _BufferBody):
+                        data = data.buffers
+                    kwargs['data'] = _gzip(data, self.compression_level)
+                    kwargs['headers'] = {'Content-Encoding': 'gzip'}
+            if bytes is str and isinstance(kwargs['data'], _BufferBody):
+                # httplib of Python 2 can only send a body as one string
+                kwargs['data'] = kwargs['data'].getvalue()
 
         if not hasattr(requests, method.lower()):
             raise ESClientException("No such HTTP Method '%s'!" %
                                     method.upper())
 
-        self.last_response = requests.request(method.lower(), url, **kwargs)
-        log.debug(self.last_response)
+        if self.sniff_interval is not None and \
+                _now() - self._last_sniff >= self.sniff_interval:
+            try:
+                self.sniff_nodes()
+            except Exception as e:
+                # Sniffing is housekeeping, it should not fail the request
+                log.warning("Sniffing failed, keeping %s: %s",
+                            self.node_pool.nodes, e)
+                self._last_sniff = _now()
+
+        if request is None:
+            response = self._send_with_retries(method.upper(), path, kwargs)
+        else:
+            response = self._send_instrumented(method.upper(), path, kwargs,
+                                               request, start)
+        log.debug(response)
+        if self.track_last_response:
+            self.last_response = response
+        return response
+
+    def _send_instrumented(self, method, path, kwargs, request, start):
+        """_send_with_retries() for send_request(), measuring the request
+        and calling the hooks."""
+        request['serialize'] = _now() - start
+        if hasattr(kwargs.get('data'), '__len__'):
+            request['bytes_sent'] = len(kwargs['data'])
+        self._run_hooks('before_request', request)
+        self._local.request = None
+        try:
+            response = self._send_with_retries(method, path, kwargs, request)
+        except Exception as e:
+            request['error'] = e
+            response = None
+        else:
+            request['status'] = response.status_code
+            length = response.headers.get('Content-Length')
+            if length is not None:
+                request['bytes_received'] = int(length)
+            if not kwargs.get('stream'):
+                if length is None:
+                    request['bytes_received'] = len(response.content)
+                self._local.request = request
+        if self.metrics is not None:
+            self.metrics.record(request)
+        self._run_hooks('after_request', request, response)
+        if response is None:
+            raise request['error']
+        return response
+
+    def _send_with_retries(self, method, path, kwargs, request=None):
+        """Send a request to one of the nodes, retrying according to the
+        retry policy. Returns the last response, or raises the last
+        exception when no attempt got a response. The attempts and the time
+        they took are added to request, when given."""
+        policy = self.retry_policy
+        max_attempts = policy.max_attempts or len(self.node_pool)
+        if policy.deadline is not None:
+            deadline = _now() + policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            if policy.deadline is not None:
+                kwargs['timeout'] = min(self.request_timeout,
+                                        max(deadline - _now(), 0.001))
+            node = self.node_pool.get()
+            error = None
+            if request is not None:
+                request['attempts'] = attempt
+                start = _now()
+            try:
+                response = self.session.request(method, node.url + path,
+                                                **kwargs)
+            except Exception as e:
+                error = e
+                # A node that can not be reached is marked dead, so that a
+                # retry goes to another node. A node that is only slow to
+                # respond is not.
+                unreachable = isinstance(e, requests.ConnectionError)
+                self.node_pool.release(node, success=not unreachable)
+                retry = policy.retries(e)
+                reason = repr(e)
+            else:
+                self.node_pool.release(node)
+                retry = response.status_code in policy.retry_on_status
+                reason = "status %d" % response.status_code
+            if request is not None:
+                request['network'] += _now() - start
+
+            if retry and attempt < max_attempts:
+                delay = policy.backoff(attempt)
+                if policy.deadline is None or _now() + delay < deadline:
+                    log.warning("%s %s failed with %s, retrying in %.2fs",
+                                method, path, reason, delay)
+                    if error is None:
+                        # Give the connection of a streamed response back
+                        response.close()
+                    time.sleep(delay)
+                    continue
+            if error is not None:
+                raise error
+            return response
+
+    def sniff_nodes(self):
+        """Replace the list of nodes by the nodes of the cluster that have
+        HTTP enabled, as listed by the nodes info API.
+
+        Returns the list of node URLs. They get the scheme of the URL the
+        client was created with.
+
+        """
+        self._last_sniff = _now()
+        scheme = self.es_url.split('://', 1)[0]
+        response = self.send_request('GET', '/_nodes/http')
+        result = self._parse_json_response(response.content)
+        urls = []
+        for info in result.get('nodes', {}).values():
+            address = info.get('http_address') or \
+                info.get('http', {}).get('publish_address')
+            url = address and _parse_publish_address(address, scheme)
+            if url:
+                urls.append(url)
+        if urls:
+            self.node_pool.set_nodes(sorted(urls))
+        else:
+            log.warning("Sniffing found no nodes, keeping %s",
+                        self.node_pool.nodes)
+        return urls
+
+    def _read_request(self, method, path, indexes, body=None,
+                      query_string_args=None):
+        """Make a request that only reads from the given indexes, through
+        the response cache and the single flight of the client, when it has
+        them."""
+        if self.cache is None and self.single_flight is None:
+            return self.send_request(method, path, body=body,
+                                     query_string_args=query_string_args)
+
+        # A cached or shared response is not parse timed as the response of
+        # the previous request
+        self._local.request = None
+        key = ResponseCache.make_key(method, path, query_string_args, body)
+        if self.cache is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+
+        def fetch():
+            response = self.send_request(method, path, body=body,
+                                         query_string_args=query_string_args)
+            if self.cache is not None and response.status_code == 200:
+                self.cache.put(key, indexes, response)
+            return response
+
+        if self.single_flight is not None:
+            return self.single_flight.do(key, fetch)
+        return fetch()
+
+    def _invalidate(self, indexes):
+        """Drop cached responses for indexes that were written to."""
+        if self.cache is not None:
+            self.cache.invalidate(list(indexes))
 
     def _search_operation(self, request_type, query_body=None,
                     operation_type="_search", query_string_args=None,
-                    indexes=["_all"], doctypes=[]):
+                    indexes=["_all"], doctypes=[], cacheable=False,
+                    stream=False):
         """Perform a search operation. This method can be used for search and
         counting by using the operation types:
             _search, _count
@@ -150,20 +1600,31 @@ class ESClient:
         1) with a query string, by providing query_args
         2) using a full query body (JSON) by providing the query_body
 
+        With stream, a HitStream is returned instead of the parsed response.
+
         """
 
+        index_names = indexes
         indexes = ','.join(indexes)
         doctypes = ','.join(doctypes)
         path = self._make_path([indexes, doctypes, operation_type])
 
-        self.send_request(request_type, path, body=query_body,
-                            query_string_args=query_string_args)
+        if stream:
+            response = self.send_request(request_type, path, body=query_body,
+                    query_string_args=query_string_args, stream=True)
+            return HitStream(response, self.codec)
+        if cacheable:
+            response = self._read_request(request_type, path, index_names,
+                    body=query_body, query_string_args=query_string_args)
+        else:
+            response = self.send_request(request_type, path, body=query_body,
+                                         query_string_args=query_string_args)
 
         try:
-            return self._parse_json_response(self.last_response.text)
+            return self._parse_json_response(response.content)
         except:
             raise ESClientException("Was unable to parse the ElasticSearch "
-            "response as JSON: \n%s", self.last_response.text)
+            "response as JSON: \n%s", response.text)
 
     #
     # The API methods
@@ -197,8 +1658,10 @@ class ESClient:
             args["routing"] = routing
 
         path = self._make_path([index, doctype, str(docid)])
-        self.send_request('POST', path, body=body, query_string_args=args)
-        rescode = self.last_response.status_code
+        response = self.send_request('POST', path, body=body,
+                                     query_string_args=args)
+        self._invalidate([index])
+        rescode = response.status_code
         if 200 <= rescode < 300:
             return True
         elif rescode == 409 and op_type == "create":
@@ -208,7 +1671,7 @@ class ESClient:
             return False
 
     def search(self, query_body=None, query_string_args=None,
-                indexes=["_all"], doctypes=[]):
+                indexes=["_all"], doctypes=[], stream=False):
         """Perform a search operation.
 
         Searching in ElasticSearch can be done in two ways:
@@ -217,27 +1680,90 @@ class ESClient:
         the query_body.
         You can choose one, but not both at the same time.
 
+        With stream=True a HitStream is returned, which yields the hits while
+        the response is being received, instead of the whole response at
+        once. Use it for large pages, which would otherwise be held in
+        memory twice: as JSON and as Python objects.
+
         """
         if query_body and query_string_args:
             raise ESClientException("Both query_body and query_string_args" +
             "provided, please use only on at a time")
         return self._search_operation('GET', query_body=query_body,
                 query_string_args=query_string_args, indexes=indexes,
-                doctypes=doctypes)
+                doctypes=doctypes, cacheable=not stream, stream=stream)
+
+    def msearch(self, queries, query_string_args=None, raise_on_error=True):
+        """Perform several searches with one multi search request.
+
+        Every query is a dict with the query_body and optionally the indexes
+        and doctypes to search, as for search(), and a header dict with
+        other options of the search, such as search_type, preference or
+        routing, e.g.:
+        {'query_body': {'query': {'match_all': {}}}, 'indexes': ['contacts']}
+
+        Returns the search results in the order of the queries.
+
+        Arguments:
+            queries -- a list of query dicts
+            query_string_args -- optional arguments for the whole request
+            raise_on_error -- raise a MultiSearchError when any of the
+                searches failed. Otherwise the failed searches are returned
+                as responses with an error.
+
+        """
+        chunks = []
+        for query in queries:
+            header = dict(query.get('header') or {})
+            indexes = query.get('indexes')
+            if indexes:
+                header['index'] = ','.join(indexes)
+            doctypes = query.get('doctypes')
+            if doctypes:
+                header['type'] = ','.join(doctypes)
+            chunks.append(self.codec.dumps(header))
+            chunks.append(b'\n')
+            chunks.append(self.codec.dumps(query.get('query_body') or {}))
+            chunks.append(b'\n')
+        if not chunks:
+            return []
+
+        path = self._make_path(['_msearch'])
+        response = self.send_request('GET', path, body=b''.join(chunks),
+                                     query_string_args=query_string_args,
+                                     encode_json=False)
+        result = self._parse_json_response(response.content)
+        if 'responses' not in result:
+            raise ESClientException("Multi search failed: %s" %
+                                    result.get('error', result))
+        responses = result['responses']
+        if raise_on_error:
+            errors = dict((position, response['error'])
+                          for position, response in enumerate(responses)
+                          if 'error' in response)
+            if errors:
+                raise MultiSearchError(responses, errors)
+        return responses
 
     def scan(self, query_body=None, query_string_args=None,
-              indexes=["_all"], doctypes=[], scroll="10m", size=50):
+              indexes=["_all"], doctypes=[], scroll="10m", size=50,
+              search_type="scan"):
         """Perform a scan search.
 
         The scan search type allows to efficiently scroll a large result
         set. This method returns a scroll_id, which can be used to get
         more results with the scroll(id=scroll_id) method.
 
+        ElasticSearch 5 and later no longer know the scan search type; pass
+        search_type=None and sort on _doc in the query_body instead. Note
+        that the hits of the first page are lost in that case.
+
         """
         if not query_string_args:
             query_string_args = {}
 
-        query_string_args["search_type"] = "scan"
+        if search_type:
+            query_string_args["search_type"] = search_type
         query_string_args["scroll"] = scroll
         query_string_args["size"] = size
 
@@ -247,7 +1773,7 @@ class ESClient:
 
         return result["_scroll_id"]
 
-    def scroll(self, scroll_id, scroll_time="10m"):
+    def scroll(self, scroll_id, scroll_time="10m", stream=False):
         """Get the next batch of results from a scan search.
 
         ElasticSearch will return a new scroll_id to you after every
@@ -256,16 +1782,150 @@ class ESClient:
 
         Options:
         scroll_id -- the scroll id as returned by the scan method
+        stream -- return a HitStream instead of the parsed response, see
+                  search()
 
         """
         query_string_args = {}
         query_string_args["scroll"] = scroll_time
         body = scroll_id
 
-        self.send_request('GET', '/_search/scroll', body=body,
-                query_string_args=query_string_args, encode_json=False)
+        response = self.send_request('GET', '/_search/scroll', body=body,
+                query_string_args=query_string_args, encode_json=False,
+                stream=stream)
+        if stream:
+            return HitStream(response, self.codec)
+
+        return self._parse_json_response(response.content)
+
+    def clear_scroll(self, scroll_id):
+        """Free the search context of a scroll on the server.
+
+        Returns True on success, False otherwise.
 
-        return json.loads(self.last_response.text)
+        """
+        response = self.send_request('DELETE', '/_search/scroll',
+                                     body=scroll_id, encode_json=False)
+        return 200 <= response.status_code < 300
+
+    def iter_scan(self, query_body=None, query_string_args=None,
+                  indexes=["_all"], doctypes=[], scroll="10m", size=50,
+                  prefetch=1, search_type="scan", stream=False):
+        """Perform a scan search and yield the hits one at a time.
+
+        This generator takes care of the scan() and scroll() calls. While
+        the hits of one page are being consumed, a background thread already
+        fetches the next page(s); prefetch is the number of pages it may
+        fetch ahead. The scroll is cleared on the server when all hits have
+        been yielded, when an error occurs or when the generator is closed.
+
+        When search_type is not "scan", the hits of the first search
+        response are yielded as well.
+
+        With stream=True the pages are not prefetched, but every page is
+        parsed while it is being received (see search()), so that only one
+        hit is held in memory at a time, whatever the size of the pages.
+        That costs CPU: the response is scanned in Python before the hits
+        are decoded, which makes a scan several times slower. Use it when
+        pages do not fit in memory, not for speed.
+
+        """
+        if not query_string_args:
+            query_string_args = {}
+        query_string_args = dict(query_string_args, scroll=scroll, size=size)
+        if search_type:
+            query_string_args["search_type"] = search_type
+        if stream:
+            for hit in self._iter_scan_stream(query_body, query_string_args,
+                                              indexes, doctypes, scroll):
+                yield hit
+            return
+        first_page = self._search_operation('GET', query_body=query_body,
+                query_string_args=query_string_args, indexes=indexes,
+                doctypes=doctypes)
+        if '_scroll_id' not in first_page:
+            raise ESClientException("Scan failed: %s" %
+                                    first_page.get('error'))
+        scroll_id = first_page['_scroll_id']
+        pages = Queue(maxsize=prefetch)
+        stop = threading.Event()
+        state = {'scroll_id': scroll_id}
+
+        def fetch():
+            try:
+                while not stop.is_set():
+                    page = self.scroll(state['scroll_id'], scroll_time=scroll)
+                    if 'hits' not in page:
+                        raise ESClientException("Scroll failed: %s" %
+                                                page.get('error'))
+                    state['scroll_id'] = page.get('_scroll_id',
+                                                  state['scroll_id'])
+                    hits = page['hits']['hits']
+                    pages.put(hits)
+                    if not hits:
+                        return
+            except Exception as e:
+                pages.put(e)
+
+        fetcher = threading.Thread(target=fetch)
+        fetcher.daemon = True
+        fetcher.start()
+        try:
+            for hit in first_page['hits']['hits']:
+                yield hit
+            while True:
+                hits = pages.get()
+                if isinstance(hits, Exception):
+                    raise hits
+                if not hits:
+                    break
+                for hit in hits:
+                    yield hit
+        finally:
+            stop.set()
+            # Make room for a page the fetcher may still be putting
+            while True:
+                try:
+                    pages.get_nowait()
+                except Empty:
+                    break
+            fetcher.join()
+            try:
+                self.clear_scroll(state['scroll_id'])
+            except Exception:
+                log.warning("Unable to clear scroll %s", state['scroll_id'])
+
+    def _iter_scan_stream(self, query_body, query_string_args, indexes,
+                          doctypes, scroll):
+        """iter_scan() with streamed pages."""
+        scan = query_string_args.get('search_type') == 'scan'
+        page = self._search_operation('GET', query_body=query_body,
+                query_string_args=query_string_args, indexes=indexes,
+                doctypes=doctypes, stream=True)
+        first = True
+        scroll_id = None
+        try:
+            while True:
+                count = 0
+                for hit in page:
+                    count += 1
+                    yield hit
+                if '_scroll_id' not in page.result:
+                    raise ESClientException("Scroll failed: %s" %
+                                            page.result.get('error'))
+                scroll_id = page.result['_scroll_id']
+                # Only the first page of a scan search has no hits
+                if not count and not (first and scan):
+                    break
+                first = False
+                page = self.scroll(scroll_id, scroll_time=scroll, stream=True)
+        finally:
+            page.close()
+            if scroll_id is not None:
+                try:
+                    self.clear_scroll(scroll_id)
+                except Exception:
+                    log.warning("Unable to clear scroll %s", scroll_id)
 
     def delete_by_query(self, query_body=None, query_string_args=None,
                 indexes=["_all"], doctypes=[]):
@@ -278,9 +1938,11 @@ class ESClient:
         You can choose one, but not both at the same time.
 
         """
-        return self._search_operation('DELETE', query_body=query_body,
+        result = self._search_operation('DELETE', query_body=query_body,
                 query_string_args=query_string_args, indexes=indexes,
                 doctypes=doctypes, operation_type='_query')
+        self._invalidate(indexes)
+        return result
 
     def count(self, query_body=None, query_string_args=None,
                 indexes=["_all"], doctypes=[]):
@@ -296,7 +1958,7 @@ class ESClient:
         """
         return self._search_operation('GET', query_body=query_body,
                 query_string_args=query_string_args, indexes=indexes,
-                doctypes=doctypes, operation_type='_count')
+                doctypes=doctypes, operation_type='_count', cacheable=True)
 
     def get(self, index, doctype, docid, fields=None):
         """Get document from the index.
@@ -312,8 +1974,9 @@ class ESClient:
             args['fields'] = fields
 
         path = self._make_path([index, doctype, str(docid)])
-        self.send_request('GET', path, query_string_args=args)
-        return self._parse_json_response(self.last_response.text)
+        response = self._read_request('GET', path, [index],
+                                      query_string_args=args)
+        return self._parse_json_response(response.content)
 
     def mget(self, index, doctype, ids, fields=None):
         """Perform a multi get.
@@ -321,7 +1984,8 @@ class ESClient:
         Although ElasticSearch supports it, this method does not allow you to
         specify the index and/or fields per id. So you can only specify the
         index and fields once and this will be applied to all document id's
-        you want to fetch.
+        you want to fetch. Use get_many() to fetch documents from several
+        indexes or types.
 
         Arguments:
             index -- the index name
@@ -338,8 +2002,44 @@ class ESClient:
                 doc['fields'] = fields
             docs.append(doc)
         body = {'docs': docs}
-        self.send_request('GET', path, body=body)
-        return self._parse_json_response(self.last_response.text)
+        response = self._read_request('GET', path, [index], body=body)
+        return self._parse_json_response(response.content)
+
+    def get_many(self, docs, fields=None):
+        """Get documents from any number of indexes and types with one multi
+        get request.
+
+        Returns a list with a result for every document, in the same order
+        and format as get() would return them. See GetLoader to combine get
+        calls from several threads.
+
+        Arguments:
+            docs -- a list of (index, doctype, docid) tuples, or dicts with
+                _index, _type, _id and optionally fields
+            fields -- optional list of fields to return for the documents
+                that do not list their own fields
+
+        """
+        request_docs = []
+        indexes = set()
+        for doc in docs:
+            if not isinstance(doc, dict):
+                index, doctype, docid = doc
+                doc = {'_index': index, '_type': doctype, '_id': str(docid)}
+            if fields and 'fields' not in doc:
+                doc = dict(doc, fields=fields)
+            indexes.add(doc['_index'])
+            request_docs.append(doc)
+        if not request_docs:
+            return []
+        body = {'docs': request_docs}
+        response = self._read_request('GET', self._make_path(['_mget']),
+                                      sorted(indexes), body=body)
+        result = self._parse_json_response(response.content)
+        if 'docs' not in result:
+            raise ESClientException("Multi get failed: %s" %
+                                    result.get('error', result))
+        return result['docs']
 
     def delete(self, index, doctype, docid):
         """Delete document from index.
@@ -348,45 +2048,290 @@ class ESClient:
 
         """
         path = self._make_path([index, doctype, str(docid)])
-        self.send_request('DELETE', path)
-        resp = json.loads(self.last_response.text)
+        response = self.send_request('DELETE', path)
+        self._invalidate([index])
+        resp = self._parse_json_response(response.content)
         return self.check_result(resp, 'found', True)
 
     """
     Bulk API
     """
-    def _bulk_make_param(self, index, doctype, docid, op_type):
+    def _bulk_make_param(self, index, doctype, docid, op_type, parent=None,
+                         routing=None):
         """Return the bulk format data."""
-        return json.dumps({op_type: {'_index': index, '_type': doctype, '_id': docid}}) + '\n'
-
-    def bulk_index(self, index, doctype, body, docid, op_type='index'):
+        meta = {'_index': index, '_type': doctype, '_id': docid}
+        if parent is not None:
+            meta['_parent'] = parent
+        if routing is not None:
+            meta['_routing'] = routing
+        return self.codec.dumps({op_type: meta}) + b'\n'
+
+    def _bulk_source(self, body):
+        """Return the source line of a bulk action. Sources that are JSON
+        already, as bytes, bytearray or memoryview, are used without copying
+        them; only a trailing newline is cut off."""
+        if isinstance(body, _JSON_BUFFERS):
+            body = memoryview(body)
+            if body[-1:].tobytes() == b'\n':
+                body = body[:-1]
+            return body
+        return self.codec.dumps(body)
+
+    def _bulk_encode(self, action):
+        """Encode an action as used by parallel_bulk()."""
+        op_type = action.get('_op_type', 'index')
+        data = self._bulk_make_param(action['_index'], action['_type'],
+                                     action.get('_id'), op_type,
+                                     parent=action.get('_parent'),
+                                     routing=action.get('_routing'))
+        if op_type != 'delete':
+            return (data, self._bulk_source(action['_source']), b'\n')
+        return data
+
+    def _bulk_chunks(self, actions, chunk_size, max_bytes):
+        """Encode actions and group them into lists of (data, action)
+        tuples of at most chunk_size actions and max_bytes bytes."""
+        chunk = []
+        size = 0
+        for action in actions:
+            data = self._bulk_encode(action)
+            data_size = sum(len(buffer) for buffer in _buffers(data))
+            if chunk and (len(chunk) >= chunk_size or
+                          size + data_size > max_bytes):
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append((data, action))
+            size += data_size
+        if chunk:
+            yield chunk
+
+    def _bulk_add(self, data, index):
+        """Add an action to the bulk buffer and push the buffer if it is
+        full. Returns the result of bulk_push() if the buffer was pushed and
+        None otherwise."""
+        self.bulk_buffer.append(data, index)
+        if self.bulk_buffer.is_full():
+            return self.bulk_push()
+
+    def bulk_index(self, index, doctype, body, docid, op_type='index',
+                   parent=None, routing=None):
         """Bulk index the supplied document. You can call this method repeatedly
         to add actions to the bulk request and finally call bulk_push() to fire the
-        complete bulk request."""
-        data = self._bulk_make_param(index, doctype, docid, op_type) + json.dumps(body) + '\n'
-        self.bulk_data += data
+        complete bulk request.
+
+        body is the document, or the document as JSON in bytes, a bytearray
+        or a memoryview. JSON documents are sent as they are, without
+        decoding, encoding or copying them, and must be on a single line.
+        On Python 2, where bytes is str, only a bytearray or memoryview is
+        taken as JSON.
+
+        If the bulk buffer has limits set and this action fills it up, the
+        buffer is pushed right away and the result of bulk_push() is
+        returned."""
+        data = (self._bulk_make_param(index, doctype, docid, op_type, parent,
+                                      routing), self._bulk_source(body), b'\n')
+        return self._bulk_add(data, index)
 
     def bulk_delete(self, index, doctype, docid):
         """Bulk delete document from index. You can call this method repeatedly
         to add actions to the bulk request and finally call bulk_push() to fire the
         complete bulk request."""
         data = self._bulk_make_param(index, doctype, docid, 'delete')
-        self.bulk_data += data
+        return self._bulk_add(data, index)
 
-    def bulk_push(self):
+    def _bulk_items(self, response, count):
+        """Return the took of a bulk request and a list of (op_type, item)
+        tuples, one for each of the count actions that were sent. When the
+        request as a whole failed, took is 0 and every item gets the status
+        code of the response.
+
+        """
+        if 200 <= response.status_code < 300:
+            try:
+                result = self._parse_json_response(response.content)
+                items = []
+                for entry in result['items']:
+                    op_type, item = list(entry.items())[0]
+                    items.append((op_type, item))
+                return result.get('took', 0), items
+            except (ESClientException, KeyError, IndexError):
+                error = "Unable to parse bulk response"
+        else:
+            error = response.text
+        return 0, [(None, {'status': response.status_code, 'error': error})
+                   for _ in range(count)]
+
+    def _send_bulk(self, actions, indexes, retry=False, max_retries=3,
+                   backoff=0.5):
+        """Send a list of (data, action) tuples as bulk requests, where data
+        is the encoded action and action is what will be reported back in
+        the BulkResult. indexes are the names of the indexes written to.
+
+        With retry, actions that failed with one of the
+        RETRYABLE_BULK_STATUSES are sent again, up to max_retries times,
+        with the backoff of a RetryPolicy (see _bulk_retry_policy()).
+
+        """
+        path = self._make_path(['_bulk'])
+        result = BulkResult()
+        retried = 0
+        policy = _bulk_retry_policy(max_retries, backoff, self.retry_policy)
+        deadline = None
+        if policy.deadline is not None:
+            deadline = _now() + policy.deadline
+        while actions:
+            result.attempts += 1
+            body = _BufferBody(data for data, _ in actions)
+            response = self.send_request('POST', path, body=body,
+                                         encode_json=False)
+            self._invalidate(indexes)
+            delay = None
+            if retry:
+                delay = _bulk_retry_delay(policy, result.attempts, deadline)
+            actions = self._bulk_collect(result, actions, response,
+                                         delay is not None)
+            retried += len(actions)
+            if actions:
+                time.sleep(delay)
+        if self.metrics is not None:
+            self.metrics.add('bulk', items=len(result),
+                             items_failed=len(result.failed),
+                             items_retried=retried)
+        return result
+
+    def _bulk_collect(self, result, actions, response, may_retry):
+        """Add the outcome of a bulk request to result. Returns the actions
+        that should be retried."""
+        result.status_code = response.status_code
+        took, items = self._bulk_items(response, len(actions))
+        result.took += took
+        retries = []
+        for (data, action), (op_type, item) in zip(actions, items):
+            item = dict(item, op_type=op_type, action=action)
+            if 'error' not in item:
+                result.succeeded.append(item)
+            elif may_retry and item.get('status') in RETRYABLE_BULK_STATUSES:
+                retries.append((data, action))
+            else:
+                result.failed.append(item)
+        return retries
+
+    def bulk_push(self, retry=False, max_retries=3, backoff=0.5):
         """Make a raw HTTP bulk request to ElasticSearch. All actions added with
         bulk_index() and bulk_delete() will be send to ElasticSearch.
-        Returns true if the index was deleted and false otherwise.
+
+        Returns a BulkResult listing the actions that succeeded and failed.
+        The result is true if all actions succeeded (or there was nothing to
+        send) and false otherwise.
+
+        Arguments:
+        retry -- resend the actions that were rejected with a retryable
+                 status (e.g. 429 when the bulk queue is full)
+        max_retries -- the maximum number of times to resend
+        backoff -- the number of seconds to wait before the first retry,
+                   doubled for every following retry. The jitter,
+                   max_backoff and deadline of the retry_policy of the
+                   client apply, see RetryPolicy.
+
+        If the request raises, e.g. because no node could be reached, the
+        actions stay in the buffer, so that bulk_push() can be called
+        again.
 
         """
-        path = self._make_path(['_bulk'])
-        self.send_request('POST', path, body=self.bulk_data, encode_json=False)
-        self.bulk_data = ''
-        rescode = self.last_response.status_code
-        if 200 <= rescode < 300:
-            return True
-        else:
-            return False
+        buffer = self.bulk_buffer
+        actions = [(data, data) for data in buffer.actions]
+        result = self._send_bulk(actions, buffer.indexes, retry=retry,
+                                 max_retries=max_retries, backoff=backoff)
+        buffer.clear()
+        return result
+
+    def parallel_bulk(self, actions, chunk_size=500,
+                      max_bytes=10 * 1024 * 1024, workers=4, retry=False,
+                      max_retries=3, backoff=0.5):
+        """Send a stream of actions with several bulk requests in flight at
+        the same time.
+
+        The actions are split into chunks of at most chunk_size actions and
+        max_bytes bytes, which are sent by a pool of worker threads. This is
+        a generator that yields a BulkResult for every chunk as soon as it is
+        done, so results are not in the order of the actions. The chunk_id
+        attribute of each result is the sequence number of its chunk. If a
+        chunk could not be sent at all, all of its actions are reported as
+        failed with the exception as error.
+
+        Every action is a dict with the keys _index, _type and, except for
+        deletes, _source. Optional keys are _op_type (defaults to 'index'),
+        _id, _parent and _routing. The _source may be JSON already, see
+        bulk_index().
+
+        The workers share the connection pool of this client, so pool_maxsize
+        should be at least equal to workers.
+
+        Arguments:
+        actions -- an iterable of actions
+        chunk_size -- maximum number of actions per bulk request
+        max_bytes -- maximum size of a bulk request body
+        workers -- the number of bulk requests to keep in flight
+        retry, max_retries, backoff -- see bulk_push()
+
+        """
+        tasks = Queue(maxsize=workers)
+        results = Queue()
+
+        def worker():
+            while True:
+                task = tasks.get()
+                if task is None:
+                    return
+                chunk_id, chunk = task
+                try:
+                    indexes = set(action['_index'] for _, action in chunk)
+                    result = self._send_bulk(chunk, indexes, retry=retry,
+                                             max_retries=max_retries,
+                                             backoff=backoff)
+                except Exception as e:
+                    log.exception("Bulk request failed")
+                    result = BulkResult()
+                    result.failed = [{'status': None, 'error': str(e),
+                                      'action': action}
+                                     for _, action in chunk]
+                result.chunk_id = chunk_id
+                results.put(result)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        submitted = 0
+        received = 0
+        try:
+            for chunk in self._bulk_chunks(actions, chunk_size, max_bytes):
+                tasks.put((submitted, chunk))
+                submitted += 1
+                while True:
+                    try:
+                        result = results.get_nowait()
+                    except Empty:
+                        break
+                    received += 1
+                    yield result
+            while received < submitted:
+                received += 1
+                yield results.get()
+        finally:
+            # When the caller stops early, drop the chunks that were not
+            # picked up by a worker yet
+            while True:
+                try:
+                    tasks.get_nowait()
+                except Empty:
+                    break
+            for thread in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
 
     """
     Indices API
@@ -398,8 +2343,9 @@ class ESClient:
 
         """
         path = self._make_path([index])
-        self.send_request('PUT', path, body=body)
-        resp = json.loads(self.last_response.text)
+        response = self.send_request('PUT', path, body=body)
+        self._invalidate([index])
+        resp = self._parse_json_response(response.content)
         return self.check_result(resp, 'acknowledged', True)
 
     def delete_index(self, index):
@@ -409,8 +2355,9 @@ class ESClient:
 
         """
         path = self._make_path([index])
-        self.send_request('DELETE', path)
-        resp = json.loads(self.last_response.text)
+        response = self.send_request('DELETE', path)
+        self._invalidate([index])
+        resp = self._parse_json_response(response.content)
         return self.check_result(resp, 'acknowledged', True)
 
     def index_exists(self, index):
@@ -420,8 +2367,8 @@ class ESClient:
 
         """
         path = self._make_path([index])
-        self.send_request('HEAD', path)
-        if self.last_response.status_code == 200:
+        response = self.send_request('HEAD', path)
+        if response.status_code == 200:
             return True
         else:
             return False
@@ -434,6 +2381,7 @@ class ESClient:
         """
         path = self._make_path([index, '_refresh'])
         self.send_request('POST', path)
+        self._invalidate([index])
         return True
 
     def create_alias(self, alias, indexes):
@@ -450,8 +2398,8 @@ class ESClient:
             query['actions'].append({"add": {"index": index, "alias": alias}})
 
         path = self._make_path(['_aliases'])
-        self.send_request('POST', path, body=query)
-        resp = json.loads(self.last_response.text)
+        response = self.send_request('POST', path, body=query)
+        resp = self._parse_json_response(response.content)
         return self.check_result(resp, 'ok', True)
 
     def delete_alias(self, alias, indexes):
@@ -468,8 +2416,8 @@ class ESClient:
             query['actions'].append({"delete": {"index": index, "alias": alias}})
 
         path = self._make_path(['_aliases'])
-        self.send_request('POST', path, body=query)
-        resp = json.loads(self.last_response.text)
+        response = self.send_request('POST', path, body=query)
+        resp = self._parse_json_response(response.content)
         return self.check_result(resp, 'ok', True)
 
 
@@ -483,8 +2431,9 @@ class ESClient:
 
         """
         path = self._make_path([index, '_open'])
-        self.send_request('POST', path)
-        resp = json.loads(self.last_response.text)
+        response = self.send_request('POST', path)
+        self._invalidate([index])
+        resp = self._parse_json_response(response.content)
         return self.check_result(resp, 'acknowledged', True)
 
     def close_index(self, index):
@@ -495,8 +2444,9 @@ class ESClient:
         Returns True on success, False of failure.
         """
         path = self._make_path([index, '_close'])
-        self.send_request('POST', path)
-        resp = json.loads(self.last_response.text)
+        response = self.send_request('POST', path)
+        self._invalidate([index])
+        resp = self._parse_json_response(response.content)
         return self.check_result(resp, 'acknowledged', True)
 
     def status(self, indexes=['_all']):
@@ -506,8 +2456,8 @@ class ESClient:
 
         """
         path = self._make_path([','.join(indexes), '_status'])
-        self.send_request('GET', path)
-        return self._parse_json_response(self.last_response.text)
+        response = self.send_request('GET', path)
+        return self._parse_json_response(response.content)
 
     def flush(self, indexes=['_all'], refresh=False):
         """Flush one or more indexes.
@@ -540,8 +2490,18 @@ class ESClient:
         # and multiple types at the same time
         path = self._make_path([','.join(indexes), ','.join(doctypes),
                                 '_mapping'])
-        self.send_request('GET', path)
-        return self._parse_json_response(self.last_response.text)
+        response = self.send_request('GET', path)
+        return self._parse_json_response(response.content)
+
+    def get_settings(self, indexes=['_all']):
+        """Get the settings of one or more indexes.
+
+        Returns the JSON response converted to a hierachy of Python objects.
+
+        """
+        path = self._make_path([','.join(indexes), '_settings'])
+        response = self.send_request('GET', path)
+        return self._parse_json_response(response.content)
 
     def put_mapping(self, mapping, doctype, indexes=['_all']):
         """Register a mapping definition for a specific type. You can
@@ -556,15 +2516,16 @@ class ESClient:
 
         """
         path = self._make_path([','.join(indexes), doctype, '_mapping'])
-        self.send_request('PUT', path=path, body=mapping)
-        return self._parse_json_response(self.last_response.text)
+        response = self.send_request('PUT', path=path, body=mapping)
+        self._invalidate(indexes)
+        return self._parse_json_response(response.content)
 
     #Cluster related API
 
     def get_health(self, indexes=[]):
         path = self._make_path(['_cluster', 'health', ','.join(indexes)])
-        self.send_request('GET', path=path)
-        resp = json.loads(self.last_response.text)
+        response = self.send_request('GET', path=path)
+        resp = self._parse_json_response(response.content)
         return resp["status"]
 
 
@@ -0,0 +1,425 @@
+"""An asyncio version of ESClient.
+
+AsyncESClient offers the same API methods as ESClient, but as coroutines
+that can be awaited from an asyncio event loop. It uses aiohttp for HTTP,
+which has to be installed separately (pip install esclient[async]).
+
+This module requires Python 3.6 or later.
+
+"""
+import asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from esclient import (ESClient, ESClientException, BulkBuffer, BulkResult,
+                      get_codec, urlencode, log, _gzip, _to_bytes,
+                      _BufferBody, _normalize_url, _now, _bulk_retry_policy,
+                      _bulk_retry_delay)
+
+__all__ = ['AsyncESClient']
+
+
+class AsyncResponse(object):
+    """The parts of an HTTP response that AsyncESClient uses. The body has
+    already been read when the response is returned."""
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def __repr__(self):
+        return "<AsyncResponse [%d]>" % self.status_code
+
+
+class AsyncESClient(object):
+    """AsyncESClient wraps around the ElasticSearch REST API like ESClient
+    does, but all API methods are coroutines.
+
+    Every call returns its own result, so one client can be shared by any
+    number of concurrent tasks. At most max_concurrency requests are in
+    flight at the same time; further requests wait for a free slot.
+
+    The client should be closed with "await client.close()", or used as an
+    asynchronous context manager.
+
+    """
+
+    def __init__(self, es_url='http://localhost:9200', request_timeout=10,
+                 pool_maxsize=10, keep_alive=True, keepalive_timeout=15,
+                 max_concurrency=10, bulk_max_actions=None,
+                 bulk_max_bytes=None, bulk_max_age=None, codec='json',
+                 compression=False, compression_level=6,
+                 compression_threshold=1024):
+        """Create a new client.
+
+        Arguments:
+        es_url -- the URL of the ElasticSearch server
+        request_timeout -- timeout in seconds for a single HTTP request
+        pool_maxsize -- the maximum number of connections to keep open
+        keep_alive -- set to False to close the connection after every
+                      request
+        keepalive_timeout -- the number of seconds to keep an idle
+                             connection open
+        max_concurrency -- the maximum number of requests in flight
+        bulk_max_actions, bulk_max_bytes, bulk_max_age, codec,
+        compression, compression_level, compression_threshold -- see
+            ESClient. Request bodies are compressed in a thread of the
+            default executor, so the event loop is not blocked.
+
+        """
+        if aiohttp is None:
+            raise ESClientException("AsyncESClient needs the aiohttp "
+                                    "library, please install it first")
+        self.es_url = _normalize_url(es_url)
+        self.request_timeout = request_timeout
+        self.codec = get_codec(codec)
+        self.bulk_buffer = BulkBuffer(max_actions=bulk_max_actions,
+                                      max_bytes=bulk_max_bytes,
+                                      max_age=bulk_max_age)
+
+        self._pool_maxsize = pool_maxsize
+        self._keep_alive = keep_alive
+        self._keepalive_timeout = keepalive_timeout
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_threshold = compression_threshold
+        self._max_concurrency = max_concurrency
+        self._semaphore = None
+        self._session = None
+
+    # The helpers that do not do any I/O are shared with ESClient
+    _make_path = ESClient._make_path
+    _parse_json_response = ESClient._parse_json_response
+    check_result = ESClient.check_result
+    _bulk_make_param = ESClient._bulk_make_param
+    _bulk_source = ESClient._bulk_source
+    _bulk_items = ESClient._bulk_items
+    _bulk_collect = ESClient._bulk_collect
+
+    def _take_request(self):
+        # Requests are not measured, see ESClient.add_hook()
+        return None
+
+    def _get_session(self):
+        # The session has to be created from within the event loop
+        if self._session is None:
+            if self._keep_alive:
+                connector = aiohttp.TCPConnector(
+                    limit=self._pool_maxsize,
+                    keepalive_timeout=self._keepalive_timeout)
+            else:
+                connector = aiohttp.TCPConnector(limit=self._pool_maxsize,
+                                                 force_close=True)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout))
+        return self._session
+
+    def _get_semaphore(self):
+        # Created within the event loop too, as it is bound to a loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._semaphore
+
+    async def close(self):
+        """Close all pooled connections of this client."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def send_request(self, method, path, body=None,
+                           query_string_args={}, encode_json=True):
+        """Make a raw HTTP request to ElasticSearch and return an
+        AsyncResponse. See ESClient.send_request().
+
+        """
+        if query_string_args:
+            path = "?".join([path, urlencode(query_string_args)])
+
+        kwargs = {}
+        url = self.es_url + path
+
+        if body:
+            if encode_json:
+                kwargs['data'] = self.codec.dumps(body)
+            else:
+                kwargs['data'] = body
+            if self.compression:
+                data = kwargs['data']
+                if not isinstance(data, (bytes, bytearray, memoryview)):
+                    data = _to_bytes(data)
+                if len(data) >= self.compression_threshold:
+                    kwargs['data'] = await asyncio.get_event_loop(
+                        ).run_in_executor(None, _gzip, data,
+                                          self.compression_level)
+                    kwargs['headers'] = {'Content-Encoding': 'gzip'}
+
+        async with self._get_semaphore():
+            async with self._get_session().request(method.upper(), url,
+                                                   **kwargs) as resp:
+                content = await resp.read()
+        response = AsyncResponse(resp.status, content, resp.headers)
+        log.debug(response)
+        return response
+
+    async def _search_operation(self, request_type, query_body=None,
+                                operation_type="_search",
+                                query_string_args=None, indexes=["_all"],
+                                doctypes=[]):
+        indexes = ','.join(indexes)
+        doctypes = ','.join(doctypes)
+        path = self._make_path([indexes, doctypes, operation_type])
+
+        response = await self.send_request(
+            request_type, path, body=query_body,
+            query_string_args=query_string_args)
+        return self._parse_json_response(response.content)
+
+    #
+    # The API methods
+    #
+
+    async def index(self, index, doctype, body, docid=None, op_type=None,
+                    parent=None, routing=None):
+        """Index the supplied document. See ESClient.index()."""
+        args = dict()
+        if op_type:
+            args["op_type"] = op_type
+
+        if parent:
+            args["parent"] = parent
+
+        if routing:
+            args["routing"] = routing
+
+        path = self._make_path([index, doctype, str(docid)])
+        response = await self.send_request('POST', path, body=body,
+                                           query_string_args=args)
+        rescode = response.status_code
+        if 200 <= rescode < 300:
+            return True
+        elif rescode == 409 and op_type == "create":
+            # If document already exists, ES returns 409
+            return True
+        else:
+            return False
+
+    async def search(self, query_body=None, query_string_args=None,
+                     indexes=["_all"], doctypes=[]):
+        """Perform a search operation. See ESClient.search()."""
+        if query_body and query_string_args:
+            raise ESClientException("Both query_body and query_string_args" +
+            "provided, please use only on at a time")
+        return await self._search_operation('GET', query_body=query_body,
+                query_string_args=query_string_args, indexes=indexes,
+                doctypes=doctypes)
+
+    async def count(self, query_body=None, query_string_args=None,
+                    indexes=["_all"], doctypes=[]):
+        """Count based on a search operation. See ESClient.count()."""
+        return await self._search_operation('GET', query_body=query_body,
+                query_string_args=query_string_args, indexes=indexes,
+                doctypes=doctypes, operation_type='_count')
+
+    async def scan(self, query_body=None, query_string_args=None,
+                   indexes=["_all"], doctypes=[], scroll="10m", size=50,
+                   search_type="scan"):
+        """Perform a scan search and return the scroll_id. See
+        ESClient.scan()."""
+        query_string_args = dict(query_string_args or {}, scroll=scroll,
+                                 size=size)
+        if search_type:
+            query_string_args["search_type"] = search_type
+
+        result = await self._search_operation('GET', query_body=query_body,
+                query_string_args=query_string_args, indexes=indexes,
+                doctypes=doctypes)
+
+        return result["_scroll_id"]
+
+    async def scroll(self, scroll_id, scroll_time="10m"):
+        """Get the next batch of results from a scan search."""
+        response = await self.send_request(
+            'GET', '/_search/scroll', body=scroll_id,
+            query_string_args={"scroll": scroll_time}, encode_json=False)
+        return self._parse_json_response(response.content)
+
+    async def clear_scroll(self, scroll_id):
+        """Free the search context of a scroll on the server."""
+        response = await self.send_request('DELETE', '/_search/scroll',
+                                           body=scroll_id, encode_json=False)
+        return 200 <= response.status_code < 300
+
+    async def iter_scan(self, query_body=None, query_string_args=None,
+                        indexes=["_all"], doctypes=[], scroll="10m", size=50,
+                        search_type="scan"):
+        """Perform a scan search and yield the hits one at a time, with
+        "async for". The next page is fetched while the hits of the current
+        page are consumed. See ESClient.iter_scan().
+
+        """
+        query_string_args = dict(query_string_args or {}, scroll=scroll,
+                                 size=size)
+        if search_type:
+            query_string_args["search_type"] = search_type
+        page = await self._search_operation('GET', query_body=query_body,
+                query_string_args=query_string_args, indexes=indexes,
+                doctypes=doctypes)
+        if '_scroll_id' not in page:
+            raise ESClientException("Scan failed: %s" % page.get('error'))
+        scroll_id = page['_scroll_id']
+        hits = page['hits']['hits']
+        next_page = None
+        try:
+            while True:
+                next_page = asyncio.ensure_future(self.scroll(scroll_id,
+                                                              scroll))
+                for hit in hits:
+                    yield hit
+                page = await next_page
+                next_page = None
+                if 'hits' not in page:
+                    raise ESClientException("Scroll failed: %s" %
+                                            page.get('error'))
+                scroll_id = page.get('_scroll_id', scroll_id)
+                hits = page['hits']['hits']
+                if not hits:
+                    break
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+            try:
+                await self.clear_scroll(scroll_id)
+            except Exception:
+                log.warning("Unable to clear scroll %s", scroll_id)
+
+    async def get(self, index, doctype, docid, fields=None):
+        """Get document from the index. See ESClient.get()."""
+        args = dict()
+        if fields:
+            args['fields'] = ",".join(fields)
+
+        path = self._make_path([index, doctype, str(docid)])
+        response = await self.send_request('GET', path,
+                                           query_string_args=args)
+        return self._parse_json_response(response.content)
+
+    async def mget(self, index, doctype, ids, fields=None):
+        """Perform a multi get. See ESClient.mget()."""
+        path = self._make_path([index, doctype, '_mget'])
+        docs = []
+        for id in ids:
+            doc = {'_id': id}
+            if fields:
+                doc['fields'] = fields
+            docs.append(doc)
+        response = await self.send_request('GET', path, body={'docs': docs})
+        return self._parse_json_response(response.content)
+
+    async def delete(self, index, doctype, docid):
+        """Delete document from index. See ESClient.delete()."""
+        path = self._make_path([index, doctype, str(docid)])
+        response = await self.send_request('DELETE', path)
+        resp = self._parse_json_response(response.content)
+        return self.check_result(resp, 'found', True)
+
+    #
+    # Bulk API
+    #
+
+    async def _bulk_add(self, data):
+        self.bulk_buffer.append(data)
+        if self.bulk_buffer.is_full():
+            return await self.bulk_push()
+
+    async def bulk_index(self, index, doctype, body, docid, op_type='index',
+                         parent=None, routing=None):
+        """Add a document to the bulk buffer. See ESClient.bulk_index()."""
+        data = (self._bulk_make_param(index, doctype, docid, op_type, parent,
+                                      routing), self._bulk_source(body), b'\n')
+        return await self._bulk_add(data)
+
+    async def bulk_delete(self, index, doctype, docid):
+        """Add a delete to the bulk buffer. See ESClient.bulk_delete()."""
+        data = self._bulk_make_param(index, doctype, docid, 'delete')
+        return await self._bulk_add(data)
+
+    async def bulk_push(self, retry=False, max_retries=3, backoff=0.5):
+        """Send the bulk buffer and return a BulkResult. See
+        ESClient.bulk_push()."""
+        # The buffer is cleared right away, as other tasks may add actions
+        # to it while the request is in flight
+        buffer = self.bulk_buffer
+        pending = buffer.actions
+        buffer.clear()
+        actions = [(data, data) for data in pending]
+        path = self._make_path(['_bulk'])
+        result = BulkResult()
+        policy = _bulk_retry_policy(max_retries, backoff)
+        deadline = None
+        if policy.deadline is not None:
+            deadline = _now() + policy.deadline
+        try:
+            while actions:
+                result.attempts += 1
+                body = _BufferBody(data for data, _ in actions).getvalue()
+                response = await self.send_request('POST', path, body=body,
+                                                   encode_json=False)
+                delay = None
+                if retry:
+                    delay = _bulk_retry_delay(policy, result.attempts,
+                                              deadline)
+                actions = self._bulk_collect(result, actions, response,
+                                             delay is not None)
+                if actions:
+                    await asyncio.sleep(delay)
+        except BaseException:
+            # Put the actions back, in front of those added meanwhile
+            added = buffer.actions
+            buffer.clear()
+            for data in pending + added:
+                buffer.append(data)
+            raise
+        return result
+
+    #
+    # Indices API
+    #
+
+    async def create_index(self, index, body=None):
+        """Create an index. See ESClient.create_index()."""
+        response = await self.send_request('PUT', self._make_path([index]),
+                                           body=body)
+        resp = self._parse_json_response(response.content)
+        return self.check_result(resp, 'acknowledged', True)
+
+    async def delete_index(self, index):
+        """Delete an entire index. See ESClient.delete_index()."""
+        response = await self.send_request('DELETE',
+                                           self._make_path([index]))
+        resp = self._parse_json_response(response.content)
+        return self.check_result(resp, 'acknowledged', True)
+
+    async def index_exists(self, index):
+        """Check if index exists."""
+        response = await self.send_request('HEAD', self._make_path([index]))
+        return response.status_code == 200
+
+    async def refresh(self, index):
+        """Refresh index."""
+        await self.send_request('POST', self._make_path([index, '_refresh']))
+        return True
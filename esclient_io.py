@@ -0,0 +1,564 @@
+"""Parallel compression and decompression of esdump files.
+
+CompressedWriter compresses the data written to it in blocks, with a pool
+of threads, while CompressedReader decompresses a file in the background
+while its lines are being read. zlib and bz2 release the GIL while they
+work, so the blocks are really (de)compressed in parallel.
+
+Every block becomes a member of a standard multi-member gzip or bzip2
+file, which gzip, bzip2 and the Python modules read as one stream. The
+gzip members carry their compressed size in an extra header field, so
+that CompressedReader can split a file into members and decompress them
+in parallel as well. Other gzip files and bzip2 files are decompressed in
+a single background thread.
+
+ContainerWriter and ContainerReader handle the container format of
+esdump: documents in independently compressed chunks, followed by an index
+of the chunks and the mappings of the dumped indexes. The chunks can be
+located without reading the file, so they can be decompressed in parallel
+and a restore can skip the indexes it does not need.
+
+Checkpoint saves the progress of a long running dump or import, so that
+it can be resumed after a failure.
+
+"""
+import bz2
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from esclient import ESClientException, _Future
+
+__all__ = ['CompressedWriter', 'CompressedReader', 'ContainerWriter',
+           'ContainerReader', 'is_container', 'Checkpoint', 'FORMATS']
+
+FORMATS = ('gzip', 'bz2')
+BLOCK_SIZE = 1024 * 1024
+
+# The extra field of the gzip member header: subfield "ES" with the size of
+# the whole member as a 4 byte little endian integer
+_GZIP_HEADER = struct.Struct('<4sIBBH2sHI')
+_GZIP_MAGIC = b'\x1f\x8b\x08\x04'
+
+
+def default_workers():
+    """Return the number of CPUs, at most 4."""
+    try:
+        import multiprocessing
+        return min(multiprocessing.cpu_count(), 4)
+    except (ImportError, NotImplementedError):
+        return 2
+
+
+def _gzip_member(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    size = _GZIP_HEADER.size + len(deflated) + 8
+    header = _GZIP_HEADER.pack(_GZIP_MAGIC, 0, 0, 255, 8, b'ES', 4, size)
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                          len(data) & 0xffffffff)
+    return header + deflated + trailer
+
+
+def _gzip_member_size(header):
+    """Return the size of a member written by CompressedWriter, or None when
+    header is not the start of one."""
+    magic, _, _, _, xlen, subfield, length, size = \
+        _GZIP_HEADER.unpack(header)
+    if magic == _GZIP_MAGIC and xlen == 8 and subfield == b'ES' and \
+            length == 4:
+        return size
+    return None
+
+
+def _gunzip_member(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+class _OrderedPool(object):
+    """Runs function on the submitted items in worker threads. Iterating
+    over the pool yields the results in the order the items were submitted,
+    until finish() is called.
+
+    At most max_pending results are waiting to be read; submit() blocks
+    until there is room for another one. finish() must be called after the
+    last item has been submitted.
+
+    """
+
+    def __init__(self, function, workers, max_pending):
+        self.function = function
+        self.tasks = Queue()
+        self.results = Queue(max_pending)
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            item, future = task
+            try:
+                future.set_result(self.function(item))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, item):
+        future = _Future()
+        self.results.put(future)
+        self.tasks.put((item, future))
+
+    def put_result(self, result):
+        """Add a result that has been computed already."""
+        future = _Future()
+        future.set_result(result)
+        self.results.put(future)
+
+    def put_exception(self, error):
+        future = _Future()
+        future.set_exception(error)
+        self.results.put(future)
+
+    def finish(self):
+        """End the results after the items submitted so far, and wait for
+        the worker threads to stop. Threads that are still running when the
+        interpreter exits make Python 2 print errors."""
+        self.results.put(None)
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __iter__(self):
+        while True:
+            future = self.results.get()
+            if future is None:
+                return
+            yield future.result()
+
+
+def _check_format(fmt):
+    if fmt not in FORMATS:
+        raise ESClientException("Unknown compression format '%s', use one "
+                                "of %s" % (fmt, ", ".join(FORMATS)))
+
+
+class CompressedWriter(object):
+    """A file like object that compresses what is written to it in blocks of
+    block_size bytes, with a pool of workers threads, and writes the blocks
+    to fileobj in a separate thread.
+
+    write() is not thread safe; threads that share a writer need a lock.
+
+    Arguments:
+        fileobj -- the binary file to write the compressed data to
+        fmt -- 'gzip' or 'bz2'
+        level -- the compression level, from 1 (fastest) to 9 (smallest)
+        workers -- the number of compression threads, by default the number
+            of CPUs up to 4
+        block_size -- the number of bytes to compress at a time
+
+    """
+
+    def __init__(self, fileobj, fmt='gzip', level=6, workers=None,
+                 block_size=BLOCK_SIZE):
+        _check_format(fmt)
+        if fmt == 'gzip':
+            compress = lambda data: _gzip_member(data, level)
+        else:
+            compress = lambda data: bz2.compress(data, level)
+        workers = workers or default_workers()
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.buffer = []
+        self.size = 0
+        self.error = None
+        self.closed = False
+        self.pool = _OrderedPool(compress, workers, 2 * workers)
+        self.writer = threading.Thread(target=self._write_blocks)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _write_blocks(self):
+        for block in self.pool:
+            try:
+                if self.error is None:
+                    self.fileobj.write(block)
+            except Exception as e:
+                # Keep reading the pool, so that write() does not block
+                self.error = e
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, data):
+        self._check_error()
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """Hand the buffered data to the compression threads."""
+        if self.buffer:
+            self.pool.submit(b''.join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+    def close(self):
+        """Compress and write the remaining data, wait for the threads and
+        close fileobj."""
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.pool.finish()
+        self.writer.join()
+        self.fileobj.close()
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CompressedReader(object):
+    """Reads a gzip or bzip2 file in a background thread and decompresses it
+    with a pool of worker threads. Iterating over the reader yields the
+    lines of the file, as bytes.
+
+    Arguments:
+        fileobj -- the binary file to read the compressed data from
+        fmt -- 'gzip' or 'bz2'
+        workers -- the number of decompression threads, by default the
+            number of CPUs up to 4
+        read_size -- the number of bytes to read from fileobj at a time
+
+    """
+
+    def __init__(self, fileobj, fmt='gzip', workers=None,
+                 read_size=BLOCK_SIZE):
+        _check_format(fmt)
+        workers = workers or default_workers()
+        self.fileobj = fileobj
+        self.fmt = fmt
+        self.read_size = read_size
+        self.pool = _OrderedPool(_gunzip_member, workers, 2 * workers)
+        self.reader = threading.Thread(target=self._read)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _read(self):
+        try:
+            if self.fmt == 'gzip':
+                self._read_gzip()
+            else:
+                self._read_sequential(bz2.BZ2Decompressor, b'')
+        except Exception as e:
+            self.pool.put_exception(e)
+        self.pool.finish()
+
+    def _read_gzip(self):
+        data = b''
+        eof = False
+        while True:
+            if len(data) < _GZIP_HEADER.size and not eof:
+                chunk = self.fileobj.read(self.read_size)
+                eof = not chunk
+                data += chunk
+                continue
+            if not data:
+                return
+            size = None
+            if len(data) >= _GZIP_HEADER.size:
+                size = _gzip_member_size(data[:_GZIP_HEADER.size])
+            if size is None:
+                # Not written by CompressedWriter
+                self._read_sequential(
+                    lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), data)
+                return
+            while len(data) < size and not eof:
+                chunk = self.fileobj.read(max(self.read_size,
+                                              size - len(data)))
+                eof = not chunk
+                data += chunk
+            if len(data) < size:
+                raise ESClientException("The gzip file is truncated")
+            self.pool.submit(data[:size])
+            data = data[size:]
+
+    def _read_sequential(self, decompressor, data):
+        """Decompress the rest of the file in this thread. Every member of
+        the file needs a new decompressor."""
+        current = decompressor()
+        while True:
+            if not data:
+                data = self.fileobj.read(self.read_size)
+                if not data:
+                    return
+            block = current.decompress(data)
+            data = current.unused_data
+            if data or getattr(current, 'eof', False):
+                current = decompressor()
+            if block:
+                self.pool.put_result(block)
+
+    def blocks(self):
+        """Yield the decompressed data in blocks."""
+        for block in self.pool:
+            yield block
+
+    def __iter__(self):
+        rest = b''
+        for block in self.blocks():
+            lines = (rest + block).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if rest:
+            yield rest
+
+    def close(self):
+        self.fileobj.close()
+
+
+# A container ends with the index as JSON, followed by its size and this
+# magic string
+_CONTAINER_TRAILER = struct.Struct('<Q8s')
+_CONTAINER_MAGIC = b'ESDUMP01'
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def is_container(filename):
+    """Return True if filename is a container written by ContainerWriter."""
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < _CONTAINER_TRAILER.size:
+                return False
+            f.seek(-_CONTAINER_TRAILER.size, os.SEEK_END)
+            _, magic = _CONTAINER_TRAILER.unpack(f.read())
+    except IOError:
+        return False
+    return magic == _CONTAINER_MAGIC
+
+
+class ContainerWriter(object):
+    """Writes documents into a container file.
+
+    The documents of every index and type are collected separately, so
+    every chunk holds the documents of one index and type. Chunks are
+    compressed as gzip members by a pool of worker threads and written in
+    a separate thread. close() writes the index of the chunks, with the
+    offset, size, number of documents, index and type of each, and the
+    mappings.
+
+    add() is not thread safe; threads that share a writer need a lock.
+
+    Arguments:
+        fileobj -- the binary file to write to
+        mapping -- the mappings of the dumped indexes, as returned by
+            ESClient.get_mapping(), to store in the container
+        level -- the compression level, from 1 (fastest) to 9 (smallest)
+        workers -- the number of compression threads, by default the number
+            of CPUs up to 4
+        chunk_size -- the number of uncompressed bytes per chunk
+
+    """
+
+    def __init__(self, fileobj, mapping=None, level=6, workers=None,
+                 chunk_size=CHUNK_SIZE):
+        workers = workers or default_workers()
+        self.fileobj = fileobj
+        self.mapping = mapping
+        self.chunk_size = chunk_size
+        self.buffers = {}
+        self.chunks = []
+        self.offset = 0
+        self.error = None
+        self.closed = False
+        compress = lambda item: (_gzip_member(item[0], level), item[1])
+        self.pool = _OrderedPool(compress, workers, 2 * workers)
+        self.writer = threading.Thread(target=self._write_chunks)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _write_chunks(self):
+        for data, chunk in self.pool:
+            try:
+                if self.error is None:
+                    self.fileobj.write(data)
+            except Exception as e:
+                self.error = e
+            chunk['offset'] = self.offset
+            chunk['size'] = len(data)
+            self.offset += len(data)
+            self.chunks.append(chunk)
+
+    def add(self, index, doctype, line):
+        """Add a document, a line of JSON that ends with a newline."""
+        if self.error is not None:
+            raise self.error
+        key = (index, doctype)
+        lines, size = self.buffers.get(key, ([], 0))
+        lines.append(line)
+        size += len(line)
+        if size >= self.chunk_size:
+            self._submit(key, lines)
+            lines, size = [], 0
+        self.buffers[key] = (lines, size)
+
+    def _submit(self, key, lines):
+        chunk = {'index': key[0], 'type': key[1], 'docs': len(lines)}
+        self.pool.submit((b''.join(lines), chunk))
+
+    def close(self):
+        """Write the remaining chunks and the index, and close fileobj."""
+        if self.closed:
+            return
+        self.closed = True
+        for key, (lines, _) in self.buffers.items():
+            if lines:
+                self._submit(key, lines)
+        self.buffers = {}
+        self.pool.finish()
+        self.writer.join()
+        if self.error is None:
+            index = json.dumps({'chunks': self.chunks,
+                                'mapping': self.mapping}).encode('utf-8')
+            self.fileobj.write(index)
+            self.fileobj.write(_CONTAINER_TRAILER.pack(len(index),
+                                                       _CONTAINER_MAGIC))
+        self.fileobj.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ContainerReader(object):
+    """Reads a container file written by ContainerWriter. The file is
+    memory mapped, and the chunks are decompressed by a pool of worker
+    threads. Iterating over the reader yields the documents of the
+    selected chunks as lines of JSON, in the order of the chunks.
+
+    Arguments:
+        filename -- the name of the container file
+        indexes -- only read the chunks of these indexes, all by default
+        workers -- the number of decompression threads, by default the
+            number of CPUs up to 4
+
+    The chunks and mapping attributes hold the index of the container.
+
+    """
+
+    def __init__(self, filename, indexes=None, workers=None):
+        self.workers = workers or default_workers()
+        self.fileobj = open(filename, 'rb')
+        self.data = mmap.mmap(self.fileobj.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+        trailer = self.data[-_CONTAINER_TRAILER.size:]
+        size, magic = _CONTAINER_TRAILER.unpack(trailer)
+        if magic != _CONTAINER_MAGIC:
+            raise ESClientException("%s is not a container" % filename)
+        end = len(self.data) - _CONTAINER_TRAILER.size
+        index = json.loads(self.data[end - size:end].decode('utf-8'))
+        self.mapping = index['mapping']
+        self.chunks = [chunk for chunk in index['chunks']
+                       if not indexes or chunk['index'] in indexes]
+
+    def read_chunk(self, chunk):
+        """Return the decompressed documents of a chunk."""
+        offset = chunk['offset']
+        return _gunzip_member(self.data[offset:offset + chunk['size']])
+
+    def __iter__(self):
+        pool = _OrderedPool(self.read_chunk, self.workers, 2 * self.workers)
+
+        def submit():
+            for chunk in self.chunks:
+                pool.submit(chunk)
+            pool.finish()
+
+        thread = threading.Thread(target=submit)
+        thread.daemon = True
+        thread.start()
+        for block in pool:
+            # Every document in a chunk ends with a newline
+            for line in block.split(b'\n')[:-1]:
+                yield line + b'\n'
+
+    def close(self):
+        self.data.close()
+        self.fileobj.close()
+
+
+class Checkpoint(object):
+    """The progress of a dump or import, stored as JSON in a file.
+
+    save() writes the state at most once every interval seconds, unless
+    forced. The file is replaced atomically, so it always holds a complete
+    state, even when the process is killed while saving.
+
+    Arguments:
+        filename -- the name of the checkpoint file
+        interval -- the minimum number of seconds between two saves
+
+    """
+
+    def __init__(self, filename, interval=10):
+        self.filename = filename
+        self.interval = interval
+        self.saved = None
+
+    def load(self):
+        """Return the saved state, or None if there is none."""
+        try:
+            f = open(self.filename)
+        except IOError:
+            return None
+        with f:
+            return json.load(f)
+
+    def save(self, state, force=False):
+        """Save state, a dict that can be converted to JSON. Returns True if
+        it was saved."""
+        now = time.time()
+        if not force and self.saved is not None and \
+                now - self.saved < self.interval:
+            return False
+        temp = self.filename + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception:
+            os.remove(temp)
+            raise
+        if hasattr(os, 'replace'):
+            os.replace(temp, self.filename)
+        else:
+            os.rename(temp, self.filename)
+        self.saved = now
+        return True
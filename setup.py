@@ -12,19 +12,21 @@ with open('README.rst') as file:
 
 install_requires = ['requests']
 
-if version_info < (2,7):
-    install_requires.append('argparse')
+py_modules = ['esclient', 'esclient_io']
+if version_info >= (3,6):
+    py_modules.append('esclient_async')
 
 setup(name='ESClient',
-        version="0.5.8",
+        version="0.6.0",
         description='A lightweight Python client for ElasticSearch, including a dump and import tool for indexes',
         author='Erik-Jan van Baaren',
         author_email='erikjan@gmail.com',
         url='https://github.com/eriky/ESClient',
-        py_modules=['esclient'],
+        py_modules=py_modules,
         license='New BSD license',
         keywords = ["elasticsearch"],
         install_requires = install_requires,
+        extras_require = {'async': ['aiohttp']},
         scripts = ['bin/esdump', 'bin/esimport'],
         classifiers=[
             'Development Status :: 4 - Beta',
@@ -1,4 +1,14 @@
 import esclient
+import esclient_io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 class TestESClient(unittest.TestCase):
@@ -87,6 +97,52 @@ class TestESClient(unittest.TestCase):
         for doc in result['docs']:
             self.assertTrue(doc['_id'] == '1' or  doc['_id'] == '2')
 
+    def test_get_many_api(self):
+        result = self.es.get_many([('contacts_esclient_test', 'person', 2),
+                                   {'_index': 'contacts_esclient_test',
+                                    '_type': 'person', '_id': '1'},
+                                   ('contacts_esclient_test', 'person', 3)])
+        self.assertEqual([doc['_id'] for doc in result], ['2', '1', '3'])
+        self.assertEqual([doc['found'] for doc in result], [True, True, False])
+
+    def test_get_loader(self):
+        loader = esclient.GetLoader(self.es, window=0.05)
+        results = {}
+
+        def get(docid):
+            results[docid] = loader.get('contacts_esclient_test', 'person',
+                                        docid)
+
+        threads = [threading.Thread(target=get, args=(docid,))
+                   for docid in (1, 2, 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results[1]['_source']['name'], 'Joe Tester')
+        self.assertEqual(results[2]['_source']['name'], 'Joe Schmoe')
+
+    def test_msearch_api(self):
+        queries = [{'query_body': {'query': {'match_all': {}}},
+                    'indexes': ['contacts_esclient_test'],
+                    'doctypes': ['person']},
+                   {'query_body': {'query': {'match_all': {}}},
+                    'indexes': ['contacts_esclient_test2']}]
+        result = self.es.msearch(queries)
+        self.assertEqual([r['hits']['total'] for r in result], [2, 0])
+
+        queries.append({'indexes': ['contacts_esclient_nosuchindex']})
+        try:
+            self.es.msearch(queries)
+        except esclient.MultiSearchError as e:
+            self.assertEqual(list(e.errors), [2])
+            self.assertEqual(len(e.responses), 3)
+        else:
+            self.fail("MultiSearchError not raised")
+        result = self.es.msearch(queries, raise_on_error=False)
+        self.assertTrue('error' in result[2])
+        self.assertEqual(self.es.msearch([]), [])
+
     def test_search_queryargs_api(self):
         """docstring for test_search_api"""
         query_string_args = {
@@ -130,6 +186,30 @@ class TestESClient(unittest.TestCase):
 
         self.assertEqual(total_docs, 2)
 
+    def test_iter_scan_api(self):
+        query_body = {
+            "query": {
+                "match_all": {}
+            }
+        }
+        hits = list(self.es.iter_scan(query_body=query_body,
+                                      indexes=['contacts_esclient_test'],
+                                      size=1))
+        self.assertEqual(sorted(hit['_id'] for hit in hits), ['1', '2'])
+        hits = list(self.es.iter_scan(query_body=query_body,
+                                      indexes=['contacts_esclient_test'],
+                                      size=1, stream=True))
+        self.assertEqual(sorted(hit['_id'] for hit in hits), ['1', '2'])
+
+    def test_search_stream(self):
+        stream = self.es.search({"query": {"match_all": {}}},
+                                indexes=['contacts_esclient_test'],
+                                stream=True)
+        hits = list(stream)
+        self.assertEqual(sorted(hit['_id'] for hit in hits), ['1', '2'])
+        self.assertEqual(stream.result['hits']['total'], 2)
+        self.assertEqual(stream.result['hits']['hits'], [])
+
     @unittest.skip("demonstrating skipping")
     def test_deletebyquery_querystring_api(self):
         """Delete documents with a query using querystring option"""
@@ -199,6 +279,10 @@ class TestESClient(unittest.TestCase):
         m = self.es.get_mapping(indexes=['contacts_esclient_test'])
         self.assertIn("contacts_esclient_test", m)
 
+    def test_get_settings(self):
+        settings = self.es.get_settings(indexes=['contacts_esclient_test'])
+        self.assertIn("contacts_esclient_test", settings)
+
     @unittest.skip("needs to be fixed")
     def test_put_mapping(self):
         """docstring for test_put_mapping"""
@@ -210,6 +294,13 @@ class TestESClient(unittest.TestCase):
         result = self.es.index_exists("contacts_esclient_test")
         self.assertTrue(result)
 
+    def test_context_manager(self):
+        """The client can be used as a context manager that closes its
+        connection pool on exit"""
+        with esclient.ESClient(pool_maxsize=2) as es:
+            self.assertTrue(es.index_exists("contacts_esclient_test"))
+            self.assertTrue(es.index_exists("contacts_esclient_test2"))
+
     def test_bulk(self):
         self.es.bulk_index('contacts_esclient_test', 'bulk', {'test':'test'}, 1)
         self.es.bulk_index('contacts_esclient_test', 'bulk', {'test':'test'}, 2)
@@ -235,5 +326,735 @@ class TestESClient(unittest.TestCase):
         except KeyError:
             found = result['found']
 
+    def test_bulk_result(self):
+        self.es.bulk_index('contacts_esclient_test', 'bulk', {'test':'test'}, 1)
+        self.es.bulk_delete('contacts_esclient_test', 'bulk', 1)
+        self.es.bulk_index('contacts_esclient_test', 'bulk', 'not a document', 2)
+        result = self.es.bulk_push(retry=True)
+        self.assertFalse(result)
+        self.assertEqual(len(result.succeeded), 2)
+        self.assertEqual(len(result.failed), 1)
+        self.assertEqual(result.failed[0]['op_type'], 'index')
+        self.assertTrue(result.failed[0]['error'])
+
+    def test_parallel_bulk(self):
+        actions = ({'_index': 'contacts_esclient_test', '_type': 'bulk',
+                    '_id': i, '_source': {'test': i}} for i in range(100))
+        results = list(self.es.parallel_bulk(actions, chunk_size=10,
+                                             workers=3))
+        self.assertEqual(sorted(r.chunk_id for r in results), list(range(10)))
+        self.assertTrue(all(results))
+        self.assertTrue(self.es.refresh('contacts_esclient_test'))
+        result = self.es.count(indexes=['contacts_esclient_test'],
+                               doctypes=['bulk'])
+        self.assertEqual(result['count'], 100)
+
+    def test_compression(self):
+        es = esclient.ESClient(compression=True, compression_threshold=100,
+                               track_last_response=True)
+        actions = ({'_index': 'contacts_esclient_test', '_type': 'bulk',
+                    '_id': i, '_source': {'test': i}} for i in range(100))
+        self.assertTrue(all(es.parallel_bulk(actions, chunk_size=50)))
+        self.assertEqual(
+            es.last_response.request.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(es.refresh('contacts_esclient_test'))
+        result = es.count({"query": {"match_all": {}}},
+                          indexes=['contacts_esclient_test'],
+                          doctypes=['bulk'])
+        self.assertEqual(result['count'], 100)
+        headers = es.last_response.request.headers
+        self.assertFalse('Content-Encoding' in headers)
+        # Encoded bodies may be any bytes-like object
+        document = b'{"text": "' + b'x' * 200 + b'"}'
+        for i, body in enumerate((bytearray(document), memoryview(document))):
+            response = es.send_request('PUT',
+                                       '/contacts_esclient_test/bulk/%d' % i,
+                                       body, encode_json=False)
+            self.assertTrue(response.ok)
+        self.assertEqual(response.request.headers['Content-Encoding'], 'gzip')
+
+    def test_metrics(self):
+        es = esclient.ESClient(metrics=True)
+        requests = []
+        es.add_hook('after_request',
+                    lambda request, response: requests.append(request))
+        self.assertTrue(es.index('contacts_esclient_test', 'person',
+                                 {'name': 'Tester'}, 1))
+        actions = ({'_index': 'contacts_esclient_test', '_type': 'bulk',
+                    '_id': i, '_source': {'test': i}} for i in range(100))
+        self.assertTrue(all(es.parallel_bulk(actions, chunk_size=50)))
+        es.search(indexes=['contacts_esclient_test'])
+        self.assertEqual([request['operation'] for request in requests],
+                         ['index', 'bulk', 'bulk', 'search'])
+        self.assertTrue(requests[0]['bytes_sent'] > 0)
+        self.assertEqual(requests[0]['attempts'], 1)
+
+        operations = es.metrics.snapshot()['operations']
+        self.assertEqual(operations['bulk']['requests'], 2)
+        self.assertEqual(operations['bulk']['items'], 100)
+        self.assertEqual(operations['bulk']['parse']['count'], 2)
+        self.assertEqual(operations['search']['network']['count'], 1)
+        self.assertTrue(operations['search']['bytes_received'] > 0)
+        self.assertEqual(operations['index']['errors'], 0)
+        json.dumps(operations)
+
+    def test_bulk_context(self):
+        self.es.bulk_index('contacts_esclient_test', 'bulk', {'test':'test'}, 1)
+        with self.es.bulk_context() as buffer:
+            self.es.bulk_index('contacts_esclient_test', 'bulk',
+                               {'test':'test'}, 2)
+        self.assertEqual(len(buffer.result.succeeded), 1)
+        self.assertEqual(len(self.es.bulk_buffer), 1)
+        self.assertTrue(self.es.bulk_push())
+
+    def test_threads(self):
+        """One client can be shared by several threads"""
+        errors = []
+
+        def get(docid):
+            for i in range(10):
+                result = self.es.get('contacts_esclient_test', 'person', docid)
+                if result['_id'] != str(docid):
+                    errors.append(result)
+
+        threads = [threading.Thread(target=get, args=(docid,))
+                   for docid in (1, 2, 1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_failover(self):
+        """Requests go to the next node when a node can not be reached"""
+        es = esclient.ESClient(['http://localhost:1', 'http://localhost:9200'])
+        for i in range(3):
+            self.assertTrue(es.index_exists("contacts_esclient_test"))
+        self.assertTrue(es.node_pool.nodes[0].dead_until > 0)
+
+    def test_sniff_nodes(self):
+        es = esclient.ESClient(sniff_on_start=True)
+        self.assertTrue(len(es.node_pool) >= 1)
+        self.assertTrue(es.index_exists("contacts_esclient_test"))
+
+    def test_sniff_failure(self):
+        """A failing periodic sniff does not fail the request"""
+        es = esclient.ESClient(sniff_interval=0)
+        nodes = list(es.node_pool.nodes)
+        def sniff_nodes():
+            raise esclient.ESClientException("sniffing is down")
+        es.sniff_nodes = sniff_nodes
+        self.assertTrue(es.index_exists("contacts_esclient_test"))
+        self.assertEqual(es.node_pool.nodes, nodes)
+
+    def test_cache(self):
+        es = esclient.ESClient(cache=True)
+        query_body = {"query": {"term": {"name": "joe"}}}
+        result = es.search(query_body, indexes=['contacts_esclient_test'])
+        self.assertEqual(result['hits']['total'], 2)
+        result = es.search(query_body, indexes=['contacts_esclient_test'])
+        self.assertEqual(es.cache.hits, 1)
+        es.delete('contacts_esclient_test', 'person', 1)
+        self.assertEqual(len(es.cache), 0)
+        es.refresh('contacts_esclient_test')
+        result = es.search(query_body, indexes=['contacts_esclient_test'])
+        self.assertEqual(result['hits']['total'], 1)
+
+    def test_coalesce_requests(self):
+        es = esclient.ESClient(coalesce_requests=True)
+        results = []
+
+        def search():
+            results.append(es.search({"query": {"term": {"name": "joe"}}},
+                                     indexes=['contacts_esclient_test']))
+
+        threads = [threading.Thread(target=search) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([r['hits']['total'] for r in results], [2] * 4)
+
+    def test_bulk_json_source(self):
+        # bytes are a document that is a string on Python 2
+        json = bytearray if bytes is str else bytes
+        large = json(b'{"text": "' + b'x' * 100000 + b'"}')
+        self.es.bulk_index('contacts_esclient_test', 'bulk',
+                           json(b'{"test": 1}\n'), 1)
+        self.es.bulk_index('contacts_esclient_test', 'bulk',
+                           memoryview(bytearray(b'{"test": 2}')), 2)
+        self.es.bulk_index('contacts_esclient_test', 'bulk', large, 3)
+        self.assertTrue(self.es.bulk_push())
+        result = self.es.get('contacts_esclient_test', 'bulk', 2)
+        self.assertEqual(result['_source'], {'test': 2})
+        result = self.es.get('contacts_esclient_test', 'bulk', 3)
+        self.assertEqual(len(result['_source']['text']), 100000)
+
+    def test_wide_integers(self):
+        doc = {"n": 123456789012345678901234567890}
+        self.assertTrue(self.es.index('contacts_esclient_test', 'person',
+                                      doc, 10))
+        result = self.es.get('contacts_esclient_test', 'person', 10)
+        self.assertEqual(result['_source'], doc)
+
+    def run_tool(self, name, *args):
+        """Run bin/esdump or bin/esimport with this version of esclient"""
+        directory = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, PYTHONPATH=directory)
+        subprocess.check_call([sys.executable,
+                               os.path.join(directory, 'bin', name),
+                               '--url', self.es.es_url] + list(args),
+                              env=env)
+
+    def test_esdump_resume(self):
+        self.assertTrue(self.es.index('contacts_esclient_test2', 'person',
+                                      {'name': 'Tester'}, 1))
+        self.es.refresh('contacts_esclient_test2')
+        directory = tempfile.mkdtemp()
+        try:
+            dump = os.path.join(directory, 'dump')
+            args = ['--indexes', 'contacts_esclient_test',
+                    'contacts_esclient_test2', '--partition', 'index',
+                    '--split', '--file', dump,
+                    '--checkpoint', os.path.join(directory, 'checkpoint')]
+            self.run_tool('esdump', *args)
+            checkpoint = esclient_io.Checkpoint(args[-1])
+            progress = checkpoint.load()
+            self.assertEqual(progress['done'], {'0': 2, '1': 1})
+
+            # As if the dump stopped before the second partition was done
+            del progress['done']['1']
+            checkpoint.save(progress, force=True)
+            with open(dump + '.0', 'w') as f:
+                f.write('done\n')
+            self.run_tool('esdump', '--resume', *args)
+            with open(dump + '.0') as f:
+                self.assertEqual(f.read(), 'done\n')
+            with open(dump + '.1') as f:
+                hits = [json.loads(line) for line in f]
+            self.assertEqual([hit['_id'] for hit in hits], ['1'])
+            self.assertEqual(checkpoint.load()['done'], {'0': 2, '1': 1})
+        finally:
+            shutil.rmtree(directory)
+
+    def test_esimport_resume(self):
+        directory = tempfile.mkdtemp()
+        try:
+            dump = os.path.join(directory, 'dump')
+            rejects = os.path.join(directory, 'rejects')
+            with open(dump, 'w') as f:
+                for docid in range(6):
+                    # Every other document is not an object, and rejected
+                    source = docid % 2 and 'rejected' or {'test': docid}
+                    f.write(json.dumps({'_index': 'contacts_esclient_test',
+                                        '_type': 'bulk', '_id': str(docid),
+                                        '_source': source}) + '\n')
+            args = ['--file', dump, '--reject-file', rejects,
+                    '--continue-on-error', '--batch-size', '1',
+                    '--checkpoint', os.path.join(directory, 'checkpoint')]
+            try:
+                self.run_tool('esimport', *args)
+            except subprocess.CalledProcessError:
+                pass
+            with open(rejects) as f:
+                first_reject = f.readline()
+
+            # As if the import stopped after the second line, when all
+            # rejects were written already
+            with open(dump) as f:
+                offset = len(f.readline()) + len(f.readline())
+            checkpoint = esclient_io.Checkpoint(args[-1])
+            checkpoint.save({'file': dump, 'lines': 2, 'offset': offset,
+                             'imported': 1, 'failed': 1,
+                             'rejects': len(first_reject)}, force=True)
+            try:
+                self.run_tool('esimport', '--resume', *args)
+            except subprocess.CalledProcessError:
+                pass
+            with open(rejects) as f:
+                ids = [json.loads(line)['_id'] for line in f]
+            self.assertEqual(ids, ['1', '3', '5'])
+            self.assertEqual(checkpoint.load()['failed'], 3)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_bulk_auto_push(self):
+        es = esclient.ESClient(bulk_max_actions=2)
+        self.assertEqual(es.bulk_index('contacts_esclient_test', 'bulk',
+                                       {'test': 'test'}, 1), None)
+        self.assertTrue(es.bulk_index('contacts_esclient_test', 'bulk',
+                                      {'test': 'test'}, 2))
+        self.assertEqual(len(es.bulk_buffer), 0)
+        self.assertTrue(es.bulk_push())
+
+
+class TestBulkBuffer(unittest.TestCase):
+    """Test the bulk buffer, which does not need ElasticSearch"""
+
+    def test_limits(self):
+        buf = esclient.BulkBuffer(max_actions=3, max_bytes=10)
+        self.assertFalse(buf.is_full())
+        buf.append(b'abc\n')
+        buf.append(b'def\n')
+        self.assertFalse(buf.is_full())
+        buf.append(b'ghi\n')
+        self.assertTrue(buf.is_full())
+        self.assertEqual(buf.getvalue(), b'abc\ndef\nghi\n')
+        buf.clear()
+        self.assertEqual(len(buf), 0)
+        buf.append(b'0123456789\n')
+        self.assertTrue(buf.is_full())
+
+    def test_max_age(self):
+        buf = esclient.BulkBuffer(max_age=0)
+        self.assertFalse(buf.is_full())
+        buf.append(b'abc\n')
+        self.assertTrue(buf.is_full())
+
+    def test_buffers(self):
+        buf = esclient.BulkBuffer(max_bytes=10)
+        source = memoryview(b'{"a":1}')
+        buf.append((b'abc\n', source, b'\n'))
+        self.assertEqual(buf.size, 12)
+        self.assertTrue(buf.is_full())
+        self.assertEqual(buf.getvalue(), b'abc\n{"a":1}\n')
+
+    def test_failed_push_keeps_actions(self):
+        es = esclient.ESClient('http://localhost:1', bulk_max_actions=2)
+        es.bulk_index('contacts', 'person', {'name': 'Tester'}, 1)
+        self.assertRaises(Exception, es.bulk_push)
+        self.assertEqual(len(es.bulk_buffer), 1)
+        # The same when the buffer is pushed because it is full
+        self.assertRaises(Exception, es.bulk_index, 'contacts', 'person',
+                          {'name': 'Tester'}, 2)
+        self.assertEqual(len(es.bulk_buffer), 2)
+
+
+class TestNodePool(unittest.TestCase):
+    """Test node selection, which does not need ElasticSearch"""
+
+    def test_round_robin(self):
+        pool = esclient.NodePool(['a:9200', 'b:9200/'])
+        urls = []
+        for i in range(4):
+            node = pool.get()
+            urls.append(node.url)
+            pool.release(node)
+        self.assertEqual(urls, ['http://a:9200', 'http://b:9200'] * 2)
+
+    def test_least_in_flight(self):
+        pool = esclient.NodePool(['a', 'b'], strategy='least_in_flight')
+        first = pool.get()
+        second = pool.get()
+        self.assertNotEqual(first, second)
+
+    def test_dead_node(self):
+        pool = esclient.NodePool(['a', 'b'], dead_timeout=60)
+        node = pool.get()
+        pool.release(node, success=False)
+        for i in range(3):
+            other = pool.get()
+            self.assertNotEqual(other, node)
+            pool.release(other)
+        # When every node is dead, one of them is tried anyway
+        pool.release(pool.get(), success=False)
+        self.assertTrue(pool.get() in pool.nodes)
+
+    def test_set_nodes_keeps_state(self):
+        pool = esclient.NodePool(['a', 'b'])
+        node = pool.get()
+        pool.release(node, success=False)
+        pool.set_nodes(['a', 'b', 'c'])
+        self.assertEqual(len(pool), 3)
+        self.assertTrue(node in pool.nodes)
+        self.assertEqual(node.failures, 1)
+
+    def test_parse_publish_address(self):
+        parse = esclient._parse_publish_address
+        self.assertEqual(parse("inet[/127.0.0.1:9200]"),
+                         "http://127.0.0.1:9200")
+        self.assertEqual(parse("es1/10.0.0.1:9200", "https"),
+                         "https://10.0.0.1:9200")
+
+    def test_unknown_strategy(self):
+        self.assertRaises(esclient.ESClientException, esclient.NodePool,
+                          ['a'], strategy='fastest')
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """Test the retry policy, which does not need ElasticSearch"""
+
+    def test_backoff(self):
+        policy = esclient.RetryPolicy(backoff_factor=1, max_backoff=5,
+                                      jitter=0.5)
+        for retry, delay in ((1, 1), (2, 2), (3, 4), (4, 5), (10, 5)):
+            backoff = policy.backoff(retry)
+            self.assertTrue(delay / 2.0 <= backoff <= delay)
+
+    def test_no_jitter(self):
+        policy = esclient.RetryPolicy(backoff_factor=0.5, jitter=0)
+        self.assertEqual(policy.backoff(3), 2)
+
+    def test_deadline(self):
+        """Retries stop when the deadline would be passed"""
+        import time
+        policy = esclient.RetryPolicy(max_attempts=100, backoff_factor=0.1,
+                                      deadline=0.5)
+        es = esclient.ESClient('http://localhost:1', retry_policy=policy)
+        start = time.time()
+        self.assertRaises(Exception, es.index_exists, 'test')
+        self.assertTrue(time.time() - start < 1)
+
+    def test_bulk_retry_delay(self):
+        client_policy = esclient.RetryPolicy(jitter=0, deadline=10)
+        policy = esclient._bulk_retry_policy(2, 0.5, client_policy)
+        self.assertEqual(policy.deadline, 10)
+        delay = esclient._bulk_retry_delay
+        self.assertEqual(delay(policy, 1, None), 0.5)
+        self.assertEqual(delay(policy, 2, None), 1)
+        # Only max_retries retries, and none that ends after the deadline
+        self.assertEqual(delay(policy, 3, None), None)
+        self.assertEqual(delay(policy, 1, esclient._now() + 0.1), None)
+
+    def test_retries(self):
+        policy = esclient.RetryPolicy()
+        self.assertTrue(policy.retries(esclient.requests.ConnectionError()))
+        self.assertTrue(policy.retries(esclient.requests.ConnectTimeout()))
+        self.assertFalse(policy.retries(esclient.requests.ReadTimeout()))
+        policy = esclient.RetryPolicy(retry_on_timeout=True)
+        self.assertTrue(policy.retries(esclient.requests.ReadTimeout()))
+
+    def test_read_timeout(self):
+        """A request that timed out is not sent again by default, and the
+        node is not marked dead"""
+        # Accepts connections, but never responds
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        url = 'http://127.0.0.1:%d' % server.getsockname()[1]
+        try:
+            for retry_on_timeout, attempts in ((False, 1), (True, 2)):
+                policy = esclient.RetryPolicy(max_attempts=2,
+                                              backoff_factor=0,
+                                              retry_on_timeout=retry_on_timeout)
+                es = esclient.ESClient(url, request_timeout=0.2,
+                                       retry_policy=policy, metrics=True)
+                self.assertRaises(esclient.requests.Timeout, es.index,
+                                  'contacts', 'person', {'name': 'Tester'})
+                operation = es.metrics.snapshot()['operations']['index']
+                self.assertEqual(operation['retries'], attempts - 1)
+                self.assertEqual(es.node_pool.nodes[0].failures, 0)
+        finally:
+            server.close()
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+
+class TestBulkResult(unittest.TestCase):
+    """Test collecting bulk responses, which does not need ElasticSearch"""
+
+    def test_took(self):
+        es = esclient.ESClient()
+        result = esclient.BulkResult()
+        for took in (3, 4):
+            response = FakeResponse(json.dumps({
+                'took': took, 'errors': False,
+                'items': [{'index': {'_id': '1', 'status': 201}}]
+            }).encode('utf-8'))
+            response.status_code = 200
+            es._bulk_collect(result, [(b'', 'action')], response, False)
+        self.assertEqual(result.took, 7)
+        self.assertEqual(len(result.succeeded), 2)
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test the response cache, which does not need ElasticSearch"""
+
+    def test_key_is_canonical(self):
+        cache = esclient.ResponseCache()
+        key1 = cache.make_key('GET', '/a/_search', {'q': 'x', 'size': 1},
+                              {'query': {'match_all': {}}, 'size': 1})
+        key2 = cache.make_key('get', '/a/_search', {'size': 1, 'q': 'x'},
+                              {'size': 1, 'query': {'match_all': {}}})
+        self.assertEqual(key1, key2)
+
+    def test_lru_eviction(self):
+        cache = esclient.ResponseCache(max_entries=2, max_bytes=10)
+        cache.put('a', ['i'], FakeResponse(b'aaa'))
+        cache.put('b', ['i'], FakeResponse(b'bbb'))
+        self.assertTrue(cache.get('a'))
+        cache.put('c', ['i'], FakeResponse(b'ccc'))
+        self.assertEqual(cache.get('b'), None)
+        self.assertTrue(cache.get('a'))
+        cache.put('d', ['i'], FakeResponse(b'dddddddd'))
+        self.assertEqual(list(cache.entries), ['d'])
+        self.assertEqual(cache.size, 8)
+
+    def test_ttl(self):
+        cache = esclient.ResponseCache(ttl=0)
+        cache.put('a', ['i'], FakeResponse(b'aaa'))
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.size, 0)
+
+    def test_invalidate(self):
+        cache = esclient.ResponseCache()
+        cache.put('a', ['contacts'], FakeResponse(b'a'))
+        cache.put('b', ['other'], FakeResponse(b'b'))
+        cache.put('c', ['cont*'], FakeResponse(b'c'))
+        cache.put('d', ['_all'], FakeResponse(b'd'))
+        cache.invalidate(['contacts'])
+        self.assertEqual(list(cache.entries), ['b'])
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate_patterns(self):
+        cache = esclient.ResponseCache()
+        for indexes in (['_all'], ['*'], ['']):
+            cache.put('a', ['contacts'], FakeResponse(b'a'))
+            cache.invalidate(indexes)
+            self.assertEqual(len(cache), 0)
+        cache.put('a', ['contacts'], FakeResponse(b'a'))
+        cache.put('b', ['other'], FakeResponse(b'b'))
+        cache.invalidate(['cont*'])
+        self.assertEqual(list(cache.entries), ['b'])
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test request coalescing, which does not need ElasticSearch"""
+
+    def test_shared_call(self):
+        flight = esclient.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def function():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flight.do('key', function)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(
+            target=lambda: results.append(flight.do('key', function)))
+            for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while flight.shared < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(flight.calls, {})
+        # Nothing is kept after the call
+        self.assertEqual(flight.do('key', lambda: 'new'), 'new')
+
+    def test_exception(self):
+        flight = esclient.SingleFlight()
+
+        def function():
+            raise esclient.ESClientException("failed")
+
+        self.assertRaises(esclient.ESClientException, flight.do, 'key',
+                          function)
+        self.assertEqual(flight.calls, {})
+
+
+class FakeGetClient(object):
+
+    def __init__(self):
+        self.requests = []
+
+    def get_many(self, docs):
+        self.requests.append(docs)
+        return [{'_id': doc['_id'], 'found': True} for doc in docs]
+
+
+class TestGetLoader(unittest.TestCase):
+    """Test batching of gets, which does not need ElasticSearch"""
+
+    def run_gets(self, loader, count):
+        results = [None] * count
+
+        def get(docid):
+            results[docid] = loader.get('index', 'type', docid)
+
+        threads = [threading.Thread(target=get, args=(docid,))
+                   for docid in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_batching(self):
+        client = FakeGetClient()
+        loader = esclient.GetLoader(client, max_batch=4, window=1)
+        results = self.run_gets(loader, 8)
+        self.assertEqual([doc['_id'] for doc in results],
+                         [str(docid) for docid in range(8)])
+        # Full batches are sent without waiting for the window
+        self.assertEqual([len(docs) for docs in client.requests], [4, 4])
+
+    def test_exception(self):
+        client = FakeGetClient()
+
+        def get_many(docs):
+            raise esclient.ESClientException("failed")
+
+        client.get_many = get_many
+        loader = esclient.GetLoader(client)
+        self.assertRaises(esclient.ESClientException, loader.get, 'index',
+                          'type', 1)
+        self.assertEqual(loader.pending, None)
+
+    def test_missing_docs(self):
+        client = FakeGetClient()
+        get_many = client.get_many
+        client.get_many = lambda docs: get_many(docs)[:1]
+        loader = esclient.GetLoader(client, max_batch=2, window=1)
+        errors = []
+
+        def get(docid):
+            try:
+                loader.get('index', 'type', docid)
+            except esclient.ESClientException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=get, args=(docid,))
+                   for docid in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 1)
+
+
+class TestHitsParser(unittest.TestCase):
+    """Test the incremental parser of search responses, which does not need
+    ElasticSearch"""
+
+    def test_pieces(self):
+        response = {
+            "_scroll_id": "c2Nhbjs=", "took": 3,
+            "hits": {
+                "total": 2,
+                "hits": [
+                    {"_id": "1", "_source": {"text": "a \\\"}]{[ b",
+                                             "list": [1, {"hits": []}]}},
+                    {"_id": "2", "_source": {"hits": {"hits": [1]}}}
+                ]
+            },
+            "aggregations": {"hits": {"hits": [3]}}
+        }
+        data = json.dumps(response).encode('utf-8')
+        for size in (1, 2, 7, len(data)):
+            parser = esclient.HitsParser()
+            hits = []
+            for start in range(0, len(data), size):
+                hits.extend(parser.feed(data[start:start + size]))
+            self.assertEqual([json.loads(hit.decode('utf-8')) for hit in hits],
+                             response['hits']['hits'])
+            rest = json.loads(b''.join(parser.rest).decode('utf-8'))
+            self.assertEqual(rest['hits'], {'total': 2, 'hits': []})
+            self.assertEqual(rest['aggregations'],
+                             response['aggregations'])
+
+
+    def test_large_page(self):
+        """A page is not buffered, only the current hit is"""
+        hits = [{"_id": str(i), "_source": {"text": "x" * 100}}
+                for i in range(2000)]
+        data = json.dumps({"_scroll_id": "c2Nhbjs=", "took": 3,
+                           "hits": {"total": 2000, "hits": hits}})
+        data = data.encode('utf-8')
+        parser = esclient.HitsParser()
+        count = 0
+        for start in range(0, len(data), 4096):
+            count += len(parser.feed(data[start:start + 4096]))
+            self.assertTrue(sum(len(part) for part in parser.hit) < 200)
+            self.assertTrue(sum(len(part) for part in parser.rest) < 100)
+        self.assertEqual(count, 2000)
+
+class TestMetrics(unittest.TestCase):
+    """Test the instrumentation, which does not need ElasticSearch"""
+
+    def test_histogram(self):
+        histogram = esclient.Histogram(buckets=(1, 2, 3, 4))
+        for value in range(1, 101):
+            histogram.observe(value / 25.0)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 100)
+        self.assertEqual(snapshot['buckets'], [[1, 25], [2, 50], [3, 75],
+                                               [4, 100]])
+        self.assertAlmostEqual(snapshot['p50'], 2)
+        self.assertAlmostEqual(snapshot['p90'], 3.6)
+        self.assertEqual(esclient.Histogram().percentile(0.5), None)
+
+    def test_operation_names(self):
+        names = [('GET', '/contacts/_search', 'search'),
+                 ('GET', '/_search/scroll?scroll=1m', 'scroll'),
+                 ('POST', '/_bulk', 'bulk'),
+                 ('POST', '/contacts/person/1', 'index'),
+                 ('POST', '/contacts/person', 'index'),
+                 ('GET', '/contacts/person/1', 'get'),
+                 ('DELETE', '/contacts', 'delete_index'),
+                 ('GET', '/', 'info')]
+        for method, path, name in names:
+            self.assertEqual(esclient._operation_name(method, path), name)
+
+    def test_record(self):
+        metrics = esclient.Metrics()
+        request = {'operation': 'search', 'attempts': 3, 'bytes_sent': 10,
+                   'bytes_received': 20, 'serialize': 0.001,
+                   'network': 0.01, 'status': 503, 'error': None}
+        metrics.record(request)
+        metrics.record(dict(request, attempts=1, status=200))
+        metrics.add('search', items=5)
+        search = metrics.snapshot()['operations']['search']
+        self.assertEqual(search['requests'], 2)
+        self.assertEqual(search['errors'], 1)
+        self.assertEqual(search['retries'], 2)
+        self.assertEqual(search['bytes_received'], 40)
+        self.assertEqual(search['items'], 5)
+        self.assertEqual(search['network']['count'], 2)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot()['operations'], {})
+
+
+class TestJSONCodec(unittest.TestCase):
+    """Test the JSON codecs, which do not need ElasticSearch"""
+
+    def test_codecs(self):
+        doc = {"name": u"J\u00f6e", "age": 21, "tags": ["a", "b"]}
+        for name in ('json', 'orjson', 'ujson', 'auto'):
+            try:
+                codec = esclient.get_codec(name)
+            except esclient.ESClientException:
+                continue
+            data = codec.dumps(doc)
+            self.assertTrue(isinstance(data, bytes))
+            self.assertEqual(codec.loads(data), doc)
+
+    def test_wide_integers(self):
+        """The default codec keeps integers wider than 64 bits"""
+        doc = {"n": 123456789012345678901234567890, "m": -2 ** 64}
+        codec = esclient.get_codec()
+        self.assertEqual(codec.loads(codec.dumps(doc)), doc)
+        self.assertEqual(esclient.ESClient().codec.name, 'json')
+
+    def test_unknown_codec(self):
+        self.assertRaises(esclient.ESClientException, esclient.get_codec,
+                          'nosuchcodec')
+
 if __name__ == '__main__':
     unittest.main()
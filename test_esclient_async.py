@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+import esclient_async
+
+
+class TestAsyncESClient(unittest.TestCase):
+    """Test the asyncio client against an ElasticSearch on localhost"""
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.es = esclient_async.AsyncESClient()
+        self.run_async(self.es.delete_index("contacts_esclient_async"))
+        body = {
+            "settings": {
+                "number_of_shards": 1,
+                "number_of_replicas": 0
+            }
+        }
+        self.assertTrue(self.run_async(
+            self.es.create_index("contacts_esclient_async", body)))
+
+    def tearDown(self):
+        self.assertTrue(self.run_async(
+            self.es.delete_index("contacts_esclient_async")))
+        self.run_async(self.es.close())
+        self.loop.close()
+
+    def test_concurrent_index_and_get(self):
+        async def index_and_get():
+            results = await asyncio.gather(*[
+                self.es.index("contacts_esclient_async", "person",
+                              {"name": "Tester %d" % i}, docid=i)
+                for i in range(10)])
+            self.assertTrue(all(results))
+            doc = await self.es.get("contacts_esclient_async", "person", 3)
+            self.assertEqual(doc["_source"]["name"], "Tester 3")
+        self.run_async(index_and_get())
+
+    def test_bulk_and_iter_scan(self):
+        async def bulk_and_scan():
+            for i in range(10):
+                await self.es.bulk_index("contacts_esclient_async", "person",
+                                         {"name": "Tester %d" % i}, i)
+            self.assertTrue(await self.es.bulk_push())
+            await self.es.refresh("contacts_esclient_async")
+            ids = []
+            async for hit in self.es.iter_scan(
+                    indexes=["contacts_esclient_async"], size=3):
+                ids.append(int(hit["_id"]))
+            self.assertEqual(sorted(ids), list(range(10)))
+        self.run_async(bulk_and_scan())
+
+    def test_compression(self):
+        async def bulk_and_count():
+            async with esclient_async.AsyncESClient(
+                    compression=True, compression_threshold=100) as es:
+                for i in range(10):
+                    await es.bulk_index("contacts_esclient_async", "person",
+                                        {"name": "Tester %d" % i}, i)
+                self.assertTrue(await es.bulk_push())
+                await es.refresh("contacts_esclient_async")
+                result = await es.count(indexes=["contacts_esclient_async"])
+                self.assertEqual(result["count"], 10)
+        self.run_async(bulk_and_count())
+
+    def test_url(self):
+        for url, expected in (("localhost:9200/", "http://localhost:9200"),
+                              ("https://localhost:9200",
+                               "https://localhost:9200")):
+            self.assertEqual(esclient_async.AsyncESClient(url).es_url,
+                             expected)
+
+if __name__ == '__main__':
+    unittest.main()
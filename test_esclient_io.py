@@ -0,0 +1,164 @@
+import bz2
+import gzip
+import io
+import os
+import tempfile
+import unittest
+
+import esclient_io
+
+
+def make_lines(count):
+    return [('{"_id": "%d", "_source": {"name": "Tester %d"}}\n' %
+             (i, i)).encode('utf-8') for i in range(count)]
+
+
+class ClosingBytesIO(io.BytesIO):
+    """Keeps the written data after close()."""
+
+    def close(self):
+        self.data = self.getvalue()
+        io.BytesIO.close(self)
+
+
+class TestCompressedFiles(unittest.TestCase):
+    """Test the parallel (de)compression, which does not need
+    ElasticSearch"""
+
+    def write(self, fmt, lines, **kwargs):
+        out = ClosingBytesIO()
+        with esclient_io.CompressedWriter(out, fmt, **kwargs) as writer:
+            for line in lines:
+                writer.write(line)
+        return out.data
+
+    def read(self, fmt, data, **kwargs):
+        return list(esclient_io.CompressedReader(io.BytesIO(data), fmt,
+                                                 **kwargs))
+
+    def test_gzip(self):
+        lines = make_lines(1000)
+        data = self.write('gzip', lines, block_size=1000, workers=3)
+        # A standard multi-member gzip file
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(data)).read(),
+                         b''.join(lines))
+        self.assertEqual(self.read('gzip', data, read_size=100), lines)
+
+    def test_threads_stop(self):
+        out = ClosingBytesIO()
+        writer = esclient_io.CompressedWriter(out, 'gzip', block_size=100,
+                                              workers=3)
+        for line in make_lines(100):
+            writer.write(line)
+        writer.close()
+        self.assertFalse([thread for thread in writer.pool.threads
+                          if thread.is_alive()])
+        reader = esclient_io.CompressedReader(io.BytesIO(out.data), 'gzip',
+                                              workers=3)
+        self.assertEqual(len(list(reader)), 100)
+        reader.reader.join()
+        self.assertFalse([thread for thread in reader.pool.threads
+                          if thread.is_alive()])
+
+    def test_bz2(self):
+        lines = make_lines(1000)
+        data = self.write('bz2', lines, block_size=10000)
+        self.assertEqual(self.read('bz2', data, read_size=100), lines)
+
+    def test_foreign_gzip(self):
+        lines = make_lines(100)
+        out = io.BytesIO()
+        for start in (0, 50):
+            # Two members, as written by "cat a.gz b.gz"
+            member = io.BytesIO()
+            f = gzip.GzipFile(fileobj=member, mode='wb')
+            f.write(b''.join(lines[start:start + 50]))
+            f.close()
+            out.write(member.getvalue())
+        self.assertEqual(self.read('gzip', out.getvalue(), read_size=100),
+                         lines)
+
+    def test_empty(self):
+        self.assertEqual(self.read('gzip', self.write('gzip', [])), [])
+
+    def test_corrupt(self):
+        data = self.write('gzip', make_lines(10))
+        reader = esclient_io.CompressedReader(io.BytesIO(data[:-10]), 'gzip')
+        self.assertRaises(Exception, list, reader)
+
+
+class TestContainer(unittest.TestCase):
+    """Test the container format, which does not need ElasticSearch"""
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_container(self):
+        lines = make_lines(1000)
+        mapping = {"a": {"mappings": {"person": {"properties": {}}}}}
+        writer = esclient_io.ContainerWriter(open(self.filename, 'wb'),
+                                             mapping=mapping, chunk_size=1000)
+        for number, line in enumerate(lines):
+            writer.add("ab"[number % 2], "person", line)
+        writer.close()
+        self.assertTrue(esclient_io.is_container(self.filename))
+
+        reader = esclient_io.ContainerReader(self.filename, workers=3)
+        self.assertEqual(reader.mapping, mapping)
+        self.assertEqual(sum(chunk['docs'] for chunk in reader.chunks), 1000)
+        self.assertEqual(sorted(reader), sorted(lines))
+        reader.close()
+
+        reader = esclient_io.ContainerReader(self.filename, indexes=["b"])
+        self.assertEqual(set(chunk['index'] for chunk in reader.chunks),
+                         set(["b"]))
+        self.assertEqual(list(reader), lines[1::2])
+        reader.close()
+
+    def test_not_a_container(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b''.join(make_lines(10)))
+        self.assertFalse(esclient_io.is_container(self.filename))
+        self.assertFalse(esclient_io.is_container(self.filename + 'x'))
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Test saving and loading progress, which does not need
+    ElasticSearch"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'checkpoint')
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_save_load(self):
+        checkpoint = esclient_io.Checkpoint(self.filename, interval=60)
+        self.assertEqual(checkpoint.load(), None)
+        self.assertTrue(checkpoint.save({"lines": 1}))
+        # Not saved again within the interval, unless forced
+        self.assertFalse(checkpoint.save({"lines": 2}))
+        self.assertEqual(checkpoint.load(), {"lines": 1})
+        self.assertTrue(checkpoint.save({"lines": 3}, force=True))
+        self.assertEqual(esclient_io.Checkpoint(self.filename).load(),
+                         {"lines": 3})
+        self.assertEqual(os.listdir(self.directory), ['checkpoint'])
+
+    def test_failed_save(self):
+        checkpoint = esclient_io.Checkpoint(self.filename)
+        checkpoint.save({"lines": 1})
+        # The state is written halfway when it turns out not to be JSON
+        self.assertRaises(TypeError, checkpoint.save,
+                          {"lines": 2, "state": object()}, force=True)
+        self.assertEqual(checkpoint.load(), {"lines": 1})
+        self.assertEqual(os.listdir(self.directory), ['checkpoint'])
+
+if __name__ == '__main__':
+    unittest.main()